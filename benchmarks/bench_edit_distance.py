@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+""" Times the prompt-vs-cell edit distances of a synthetic class (see `cohort.py`),
+    computed notebook by notebook and pair by pair with `distance_matrix`, and with
+    `NotebookMatcher.match_many`, which runs the bit-parallel kernel of `Patterns`
+    over `--chunk` notebooks at a time, as `NotebookExtractor.match_notebooks` does.
+
+        python benchmarks/bench_edit_distance.py --students 300 --chunk 1 8 32
+"""
+
+import argparse
+import glob
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'scripts'))
+
+import numpy as np
+import pandas as pd
+from cohort import add_cohort_arguments, make_cohort
+from edit_distance import distance_matrix
+from extract_answers_template import NotebookExtractor, NotebookMatcher
+
+
+def best_of(repeat, fn):
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        result = fn()
+        times.append(time.time() - start)
+    return min(times), result
+
+
+def per_pair(matcher, notebooks):
+    """Returns the hits of each notebook, {query -> [(cell index, distance)]}, from `distance_matrix`."""
+    thresh = matcher.matching_threshold
+    all_hits = []
+    for sources in notebooks:
+        distances = distance_matrix(matcher.queries, sources, thresh)
+        hits = {}
+        for i, idx in zip(*np.nonzero(distances <= thresh)):
+            hits.setdefault(matcher.queries[i], []).append((int(idx), int(distances[i, idx])))
+        all_hits.append(hits)
+    return all_hits
+
+
+def batched(matcher, notebooks, chunk):
+    """Returns the hits of each notebook from `match_many`, `chunk` notebooks at a time."""
+    return [matches.hits for start in range(0, len(notebooks), chunk)
+            for matches in matcher.match_many(notebooks[start:start + chunk])]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the batched edit distance kernel.')
+    parser.add_argument('--students', type=int, default=300)
+    parser.add_argument('--chunk', type=int, nargs='+', default=[1, NotebookExtractor.MATCH_CHUNK, 32],
+                        help='numbers of notebooks matched together')
+    parser.add_argument('--repeat', type=int, default=3)
+    add_cohort_arguments(parser)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='cohort{}-'.format(args.students))
+    try:
+        template_path, roster_path = make_cohort(directory, args.students, args, seed=args.seed)
+        users_df = pd.read_csv(roster_path)
+        users_df['Full Name'] = users_df['First Name'].map(str) + ' ' + users_df['Last Name']
+        nbe = NotebookExtractor(users_df, template_path)
+        notebooks = []
+        for path in sorted(glob.glob(os.path.join(directory, 'www', '*', '*', 'master', 'ThinkStats2', '*.ipynb'))):
+            with open(path) as fid:
+                notebooks.append([u''.join(cell['source']) for cell in json.load(fid)['cells']])
+    finally:
+        shutil.rmtree(directory)
+
+    matcher = NotebookMatcher.for_prompts(nbe.question_prompts, NotebookExtractor.MATCH_THRESH)
+    print "{} queries x {} notebooks of {} cells".format(len(matcher.queries), len(notebooks),
+                                                          sum(len(sources) for sources in notebooks))
+    baseline, expected = best_of(args.repeat, lambda: per_pair(matcher, notebooks))
+    print "per pair (Levenshtein):       {:.4f}s".format(baseline)
+    for chunk in args.chunk:
+        seconds, got = best_of(args.repeat, lambda: batched(matcher, notebooks, chunk))
+        assert got == expected
+        print "kernel, {:3d} notebooks/batch: {:.4f}s  ({:.2f}x)".format(chunk, seconds, baseline / seconds)
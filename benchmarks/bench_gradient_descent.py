@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+""" Times the loop and vectorized versions of `gradient_descent.py`, on the Titanic
+    passengers in datasets/ and on synthetic least squares problems of growing size.
+
+    For each, the error and gradient computations are timed both ways (and checked
+    to agree), and then the fits: full gradient descent with each gradient, and
+    mini-batch and stochastic gradient descent.  On the Titanic data the mini-batches
+    are streamed from titanic_train.csv, and the fitted weights predict who in
+    titanic_test.csv survived.
+
+        python benchmarks/bench_gradient_descent.py --rows 1000 10000 100000
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'scripts'))
+
+import numpy as np
+import pandas as pd
+import gradient_descent as gd
+
+DATASETS_DIR = os.path.join(os.path.dirname(__file__), '..', 'datasets')
+
+
+def best_of(repeat, fn):
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        result = fn()
+        times.append(time.time() - start)
+    return min(times), result
+
+
+def compare(name, repeat, loop_fn, vectorized_fn):
+    """Times `loop_fn` (unless None) and `vectorized_fn`, checks they agree, and prints the times."""
+    vectorized, got = best_of(repeat, vectorized_fn)
+    if loop_fn is None:
+        print "  {:<28} {:>10}  {:>9.5f}s".format(name, '-', vectorized)
+        return
+    loop, expected = best_of(repeat, loop_fn)
+    assert np.allclose(expected, got), name
+    print "  {:<28} {:>9.5f}s  {:>9.5f}s  ({:.0f}x)".format(name, loop, vectorized, loop / vectorized)
+
+
+def time_kernels(X, y, repeat, with_loops):
+    print "  {:<28} {:>10}  {:>10}".format('', 'loop', 'vectorized')
+    w = np.linspace(-1, 1, X.shape[1])
+    x = X[:, 1]
+    kernels = [('error', lambda: gd.error_loop(0.5, x, y), lambda: gd.error(0.5, x, y)),
+               ('error_grad', lambda: gd.error_grad_loop(0.5, x, y), lambda: gd.error_grad(0.5, x, y)),
+               ('partial_error_multi', lambda: gd.partial_error_multi_loop(w, X, y, 1),
+                lambda: gd.partial_error_multi(w, X, y, 1)),
+               ('grad_error_multi', lambda: gd.grad_error_multi_loop(w, X, y), lambda: gd.grad_error_multi(w, X, y))]
+    for name, loop_fn, vectorized_fn in kernels:
+        compare(name, repeat, loop_fn if with_loops else None, vectorized_fn)
+
+
+def time_fits(X, y, iters, epochs, batch_size, with_loops, batches=None):
+    """Times the fits of `X`, `y`; returns the weights of the full gradient descent."""
+    w_0 = np.zeros(X.shape[1])
+    alpha = 0.1 / np.sum(X * X)  # small enough that the first step lowers the error; it then adapts
+    fits = [('gradient_descent_multi', lambda: gd.gradient_descent_multi(w_0, X, y, alpha, iters))]
+    if with_loops:
+        fits.insert(0, ('  with the loop gradient',
+                        lambda: gd.gradient_descent_multi(w_0, X, y, alpha, iters, grad=gd.grad_error_multi_loop)))
+    scale = np.mean(np.sum(X * X, axis=1))
+    fits.append(('minibatch ({})'.format(batch_size),
+                 lambda: gd.minibatch_gradient_descent(w_0, batches or gd.array_batches(X, y, batch_size),
+                                                       0.5 / scale, epochs, decay=0.01)))
+    fits.append(('stochastic', lambda: gd.stochastic_gradient_descent(w_0, X, y, 0.05 / scale, epochs, decay=0.001)))
+    results = {}
+    for name, fit in fits:
+        seconds, (w, _) = best_of(1, fit)
+        results[name] = w
+        print "  {:<28} {:>9.4f}s  mean squared error {:.4f}".format(name, seconds, gd.error_multi(w, X, y) / len(y))
+    return results['gradient_descent_multi']
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the loop and vectorized least squares code.')
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='sizes of the synthetic problems')
+    parser.add_argument('--features', type=int, default=20, help='number of features of the synthetic problems')
+    parser.add_argument('--max-loop-rows', type=int, default=10000, help='time the loops only up to this size')
+    parser.add_argument('--iters', type=int, default=200, help='steps of full gradient descent')
+    parser.add_argument('--epochs', type=int, default=10, help='epochs of mini-batch and stochastic descent')
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    train_path = os.path.join(DATASETS_DIR, 'titanic_train.csv')
+    X, y = gd.titanic_features(pd.read_csv(train_path))
+    print "Titanic: {} passengers x {} features".format(*X.shape)
+    time_kernels(X, y, args.repeat, True)
+    w = time_fits(X, y, args.iters, args.epochs, args.batch_size, True,
+                  gd.csv_batches(train_path, gd.titanic_features, args.batch_size))
+    print "  training accuracy {:.3f}".format(np.mean((X.dot(w) > 0.5) == y))
+    X_test, _ = gd.titanic_features(pd.read_csv(os.path.join(DATASETS_DIR, 'titanic_test.csv')))
+    print "  predicted to survive in titanic_test.csv: {} of {}".format(int(np.sum(X_test.dot(w) > 0.5)),
+                                                                        len(X_test))
+
+    rng = np.random.RandomState(args.seed)
+    for rows in args.rows:
+        X = np.column_stack([np.ones(rows), rng.randn(rows, args.features - 1)])
+        y = X.dot(rng.randn(args.features)) + 0.1 * rng.randn(rows)
+        print "Synthetic: {} rows x {} features".format(rows, args.features)
+        with_loops = rows <= args.max_loop_rows
+        time_kernels(X, y, args.repeat, with_loops)
+        time_fits(X, y, args.iters, args.epochs, args.batch_size, with_loops)
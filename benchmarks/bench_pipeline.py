@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+""" Times each stage of `extract_answers_template.py` on synthetic classes.
+
+    For each class size, a cohort is generated (see `cohort.py`) and served by a
+    local `StandIn` for GitHub, and then the stages are timed one at a time:
+
+        fetch    downloading every student's notebook
+        parse    parsing the fetched notebooks
+        match    matching them against the prompts
+        extract  `NotebookExtractor.extract` from the fetched notebooks: parse,
+                 match and answer status together, as the script runs them
+        dedupe   clustering identical and similar answers, for each prompt
+        write    writing the summary notebook, the answer counts and the clusters
+
+    `--save` writes the timings as JSON, and `--compare` checks them against ones
+    saved earlier, reporting the stages that got slower by more than `--tolerance`:
+
+        python benchmarks/bench_pipeline.py --save before.json
+        python benchmarks/bench_pipeline.py --compare before.json
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'scripts'))
+
+import pandas as pd
+import extract_answers_template
+from cohort import add_cohort_arguments, make_cohort
+from extract_answers_template import NotebookExtractor, fetch_notebook_responses, get_github_user_notebook_url
+from fetch_engine import FetchEngine
+from output_filter import add_output_arguments, output_filter_from_args
+from stand_in import serve
+
+STAGES = ['fetch', 'parse', 'match', 'extract', 'dedupe', 'write']
+
+
+@contextmanager
+def timed(timings, stage):
+    """Records the time spent in the block as `timings[stage]`, with anything it prints discarded."""
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    start = time.time()
+    try:
+        yield
+    finally:
+        timings[stage] = time.time() - start
+        sys.stdout.close()
+        sys.stdout = stdout
+
+
+def run_stages(directory, template_path, roster_path, base_url, args):
+    """Returns an OrderedDict {stage -> seconds} for the cohort in `directory`."""
+    users_df = pd.read_csv(roster_path)
+    users_df['Full Name'] = users_df['First Name'].map(str) + ' ' + users_df['Last Name']
+    users_df['notebook_urls'] = [get_github_user_notebook_url(u, template_path, 'DataScience16', base_url)
+                                 for u in users_df['gh_username']]
+    engine = FetchEngine(concurrency=args.connections, per_host=args.connections, progress=None)
+    output_dir = os.path.join(directory, 'processed_notebooks')
+    os.mkdir(output_dir)
+    nbe = NotebookExtractor(users_df, template_path, engine=engine, jobs=args.jobs,
+                            output_filter=output_filter_from_args(args, output_dir), align=args.align)
+    extract_answers_template.PROJECT_DIR = directory
+
+    timings = OrderedDict()
+    with timed(timings, 'fetch'):
+        responses = list(fetch_notebook_responses(users_df['notebook_urls'], engine=engine))
+    usernames_by_url = dict(zip(users_df['notebook_urls'], users_df['gh_username']))
+    with timed(timings, 'parse'):
+        notebooks = list(nbe.notebooks_to_match(responses, usernames_by_url, {}))
+    with timed(timings, 'match'):
+        for _, _, cells, matches in nbe.match_notebooks(notebooks):
+            for prompt in nbe.question_prompts:
+                prompt.get_closest_match(cells, NotebookExtractor.MATCH_THRESH, False, matches)
+    del notebooks
+    with timed(timings, 'extract'):
+        nbe.extract(responses)
+    with timed(timings, 'dedupe'):
+        for prompt in nbe.question_prompts:
+            prompt.answer_clusters
+    with timed(timings, 'write'):
+        nbe.write_notebook()
+        nbe.write_answer_counts()
+        nbe.write_answer_clusters()
+    engine.close()
+    return timings
+
+
+def print_table(results):
+    print '{:>8}  '.format('students') + ''.join('{:>9}'.format(stage) for stage in STAGES)
+    for students, timings in sorted(results.items(), key=lambda t: int(t[0])):
+        print '{:>8}  '.format(students) + ''.join('{:>8.3f}s'.format(timings[stage]) for stage in STAGES)
+
+
+def compare(results, baseline, tolerance):
+    """Prints the stages slower than in `baseline` by more than `tolerance`; returns how many."""
+    regressions = 0
+    for students, timings in sorted(results.items(), key=lambda t: int(t[0])):
+        for stage in STAGES:
+            before = baseline.get(students, {}).get(stage)
+            if before and timings[stage] > before * (1 + tolerance):
+                print "Slower: {} stage with {} students, {:.3f}s -> {:.3f}s".format(
+                    stage, students, before, timings[stage])
+                regressions += 1
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the extraction pipeline on synthetic classes.')
+    parser.add_argument('--students', type=int, nargs='+', default=[50, 500, 5000], help='class sizes to time')
+    parser.add_argument('--align', action='store_true', help='benchmark alignment-based matching')
+    parser.add_argument('--jobs', type=int, default=1, help='number of worker processes for matching')
+    parser.add_argument('--connections', type=int, default=20, help='maximum number of concurrent requests')
+    parser.add_argument('--latency', type=float, default=0.0, help='delay of each response, in seconds')
+    parser.add_argument('--save', type=str, help='write the timings to this JSON file')
+    parser.add_argument('--compare', type=str, help='compare the timings with a JSON file written by --save')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='slowdown reported as a regression')
+    parser.add_argument('--keep', action='store_true', help="keep the generated cohorts, and print where")
+    add_cohort_arguments(parser)
+    add_output_arguments(parser)
+    args = parser.parse_args()
+
+    results = OrderedDict()
+    for students in args.students:
+        directory = tempfile.mkdtemp(prefix='cohort{}-'.format(students))
+        template_path, roster_path = make_cohort(directory, students, args, seed=args.seed)
+        server = serve(os.path.join(directory, 'www'), latency=args.latency)
+        try:
+            results[str(students)] = run_stages(directory, template_path, roster_path, server.url, args)
+        finally:
+            server.shutdown()
+            server.server_close()
+            if args.keep:
+                print "Kept", directory
+            else:
+                shutil.rmtree(directory)
+    print_table(results)
+
+    if args.save:
+        with open(args.save, 'w') as fid:
+            json.dump(results, fid, indent=1)
+    if args.compare:
+        with open(args.compare) as fid:
+            regressions = compare(results, json.load(fid), args.tolerance)
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+""" Generates a synthetic class of student notebooks from a base notebook.
+
+    The base notebook (by default `scripts/sample_input.ipynb`) becomes a template
+    whose markdown prompts are marked `is_question`, and each student gets a copy
+    with its answer cells filled in.  Students vary the way real submissions do:
+    some reorder the exercises, some edit prompts (within `MATCH_THRESH` edits, so
+    they still match, or beyond it, so they don't), some leave large image outputs
+    in their notebooks, many give one of a few common answers, and some never
+    submit.  The cohort directory holds the template, a roster CSV and a `www/`
+    tree laid out like GitHub's URLs, ready for `stand_in.serve`:
+
+        DIRECTORY/chap01ex.ipynb
+        DIRECTORY/users.csv
+        DIRECTORY/www/<username>/<repo>/master/ThinkStats2/chap01ex.ipynb
+"""
+
+import argparse
+import base64
+import json
+import os
+import random
+import sys
+from copy import deepcopy
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'scripts'))
+
+from extract_answers_template import NotebookExtractor
+
+BASE_NOTEBOOK = os.path.join(os.path.dirname(__file__), '..', 'scripts', 'sample_input.ipynb')
+TEMPLATE_NAME = 'chap01ex.ipynb'
+LETTERS = u'abcdefghijklmnopqrstuvwxyz '
+
+
+def make_template(base):
+    """ Returns a template made from the notebook `base`: each markdown cell that
+        is followed by an answer cell is a question, and `##` sections take every
+        cell up to the next question. """
+    template = deepcopy(base)
+    cells = template['cells']
+    for idx, cell in enumerate(cells[:-1]):
+        source = u''.join(cell['source'])
+        if cell['cell_type'] != 'markdown' or not source:
+            continue
+        following = cells[idx + 1]
+        if following['cell_type'] == 'code' or not u''.join(following['source']):
+            cell['metadata'] = {'is_question': True}
+            if source.startswith(u'##'):
+                cell['metadata']['allow_multi_cell'] = True
+    return template
+
+
+def _blocks(cells):
+    """Splits `cells` into runs that each start at a question."""
+    blocks = [[]]
+    for cell in cells:
+        if cell['metadata'].get('is_question') and blocks[-1]:
+            blocks.append([])
+        blocks[-1].append(cell)
+    return blocks
+
+
+def _edit(rng, text, edits, insert_only=False):
+    """Returns `text` with `edits` random character edits; insertions only if `insert_only`."""
+    chars = list(text)
+    for _ in range(edits):
+        pos = rng.randrange(len(chars) + 1)
+        if insert_only or pos == len(chars):
+            chars.insert(pos, rng.choice(LETTERS))
+        else:
+            chars[pos] = rng.choice(LETTERS)
+    return u''.join(chars)
+
+
+def _image_output(rng, image):
+    """A PNG display output of `image`, made distinct by a random prefix."""
+    data = base64.b64encode(str(bytearray(rng.getrandbits(8) for _ in range(16))) + image)
+    return {'output_type': 'display_data', 'metadata': {},
+            'data': {'image/png': data, 'text/plain': ['<matplotlib.figure.Figure at 0x10b3c2e10>']}}
+
+
+def make_student_notebook(rng, template, options, common_answers, image):
+    """ Returns a student's notebook for `template`, varied as `options` says.
+        `common_answers` maps a question's index to the answers most students give,
+        and `image` is the bytes of the image output some students leave in. """
+    nb = deepcopy(template)
+    blocks = _blocks(nb['cells'])
+    thresh = NotebookExtractor.MATCH_THRESH
+    for index, block in enumerate(blocks):
+        prompt = block[0]
+        if not prompt['metadata'].get('is_question'):
+            continue
+        source = u''.join(prompt['source'])
+        roll = rng.random()
+        if roll < options.edited_within:
+            prompt['source'] = _edit(rng, source, rng.randint(1, thresh))
+        elif roll < options.edited_within + options.edited_beyond:
+            prompt['source'] = _edit(rng, source, rng.randint(thresh + 1, 2 * thresh), insert_only=True)
+        for cell in block[1:]:
+            if rng.random() >= options.answered:
+                continue
+            if rng.random() < options.common:
+                cell['source'] = rng.choice(common_answers[index])
+            else:
+                cell['source'] = u'answer {} to question {}'.format(rng.getrandbits(32), index)
+            if cell['cell_type'] == 'code':
+                cell['outputs'] = [{'output_type': 'stream', 'name': 'stdout', 'text': [u'{}\n'.format(index)]}]
+    if rng.random() < options.images:
+        code_cells = [cell for cell in nb['cells'] if cell['cell_type'] == 'code']
+        rng.choice(code_cells)['outputs'].append(_image_output(rng, image))
+    if rng.random() < options.shuffled:
+        rng.shuffle(blocks)
+        nb['cells'] = [cell for block in blocks for cell in block]
+    return nb
+
+
+def make_cohort(directory, students, options, base_path=BASE_NOTEBOOK, repo_name='DataScience16', seed=0):
+    """ Writes a cohort of `students` to `directory` (see the module docstring).
+        Returns the paths of the template and the roster. """
+    rng = random.Random(seed)
+    with open(base_path) as fid:
+        template = make_template(json.load(fid))
+    template_path = os.path.join(directory, TEMPLATE_NAME)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(template_path, 'w') as fid:
+        json.dump(template, fid)
+
+    common_answers = {index: [u'common answer {} to question {}'.format(i, index) for i in range(3)]
+                      for index in range(len(_blocks(template['cells'])))}
+    image = str(bytearray(rng.getrandbits(8) for _ in range(options.image_kb * 768)))  # 4/3 that in base64
+    rows = [u'First Name,Last Name,gh_username']
+    for n in range(students):
+        username = 'student{:05d}'.format(n)
+        rows.append(u'First{},Last{},{}'.format(n % 97, n, username))
+        user_dir = os.path.join(directory, 'www', username)
+        notebook_dir = os.path.join(user_dir, repo_name, 'master', 'ThinkStats2')
+        os.makedirs(notebook_dir)  # also stands in for the GitHub profile page
+        if rng.random() < options.missing:
+            continue
+        nb = make_student_notebook(rng, template, options, common_answers, image)
+        with open(os.path.join(notebook_dir, TEMPLATE_NAME), 'w') as fid:
+            json.dump(nb, fid)
+    roster_path = os.path.join(directory, 'users.csv')
+    with open(roster_path, 'w') as fid:
+        fid.write(u'\n'.join(rows) + u'\n')
+    return template_path, roster_path
+
+
+def add_cohort_arguments(parser):
+    """Adds the options of `make_student_notebook` to an `argparse` parser."""
+    parser.add_argument('--missing', type=float, default=0.05, help='fraction of students who submit nothing')
+    parser.add_argument('--shuffled', type=float, default=0.1, help='fraction who reorder the exercises')
+    parser.add_argument('--edited-within', type=float, default=0.1,
+                        help='fraction of prompts edited, but still within the matching threshold')
+    parser.add_argument('--edited-beyond', type=float, default=0.02,
+                        help='fraction of prompts edited beyond the matching threshold')
+    parser.add_argument('--answered', type=float, default=0.8, help='fraction of answer cells filled in')
+    parser.add_argument('--common', type=float, default=0.5, help='fraction of answers that are common ones')
+    parser.add_argument('--images', type=float, default=0.1, help='fraction of notebooks with an image output')
+    parser.add_argument('--image-kb', type=int, default=50, help='size of an image output, in KB')
+    parser.add_argument('--seed', type=int, default=0)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a synthetic class of student notebooks.')
+    parser.add_argument('directory', type=str)
+    parser.add_argument('--students', type=int, default=50)
+    parser.add_argument('--base', type=str, default=BASE_NOTEBOOK, help='notebook to make the template from')
+    parser.add_argument('--repo', type=str, default='DataScience16', help='Github repository name')
+    add_cohort_arguments(parser)
+    args = parser.parse_args()
+    template_path, roster_path = make_cohort(args.directory, args.students, args, args.base, args.repo, args.seed)
+    print "Wrote", template_path, "and", roster_path
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+""" A local HTTP stand-in for GitHub, serving a directory laid out like its URLs.
+
+    Like GitHub, it sends each file with an ETag (a hash of its content) and its
+    Last-Modified time, and answers conditional requests for unchanged files with
+    304 Not Modified, so a cache's revalidation can be exercised against it.
+
+    `serve` runs the server in a background thread, so a benchmark can fetch
+    from it in the same process; run as a script, it serves until interrupted:
+
+        python benchmarks/stand_in.py COHORT_DIR/www --port 8000
+
+    and `extract_answers_template.py --github-url http://127.0.0.1:8000/
+    --raw-github-url http://127.0.0.1:8000/ ...` then extracts from it.
+"""
+
+import argparse
+import hashlib
+import os
+import threading
+import time
+import BaseHTTPServer
+import SimpleHTTPServer
+import SocketServer
+from cStringIO import StringIO
+from email.utils import mktime_tz, parsedate_tz
+
+
+class _Handler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep connections alive, as GitHub does
+
+    def do_GET(self):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        SimpleHTTPServer.SimpleHTTPRequestHandler.do_GET(self)
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        if os.path.isdir(path):
+            # a user's directory stands in for their profile page; SimpleHTTPServer's
+            # redirects and listings have no Content-Length, which stalls keep-alive clients
+            self.send_response(200)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return None
+        if not os.path.isfile(path):
+            return SimpleHTTPServer.SimpleHTTPRequestHandler.send_head(self)
+        with open(path, 'rb') as fid:
+            body = fid.read()
+        mtime = int(os.path.getmtime(path))
+        etag = '"{}"'.format(hashlib.sha1(body).hexdigest())
+        if self.not_modified(etag, mtime):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            self.server.count('not_modified')
+            return None
+        self.send_response(200)
+        self.send_header('Content-Type', self.guess_type(path))
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Last-Modified', self.date_time_string(mtime))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self.server.count('ok')
+        return StringIO(body)
+
+    def not_modified(self, etag, mtime):
+        """Whether the request's validators match a file with `etag`, last modified at `mtime`."""
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:  # it takes precedence over If-Modified-Since
+            return etag in [tag.strip() for tag in if_none_match.split(',')] or if_none_match.strip() == '*'
+        if_modified_since = parsedate_tz(self.headers.get('If-Modified-Since') or '')
+        return if_modified_since is not None and mtime <= mktime_tz(if_modified_since)
+
+    def translate_path(self, path):
+        path = SimpleHTTPServer.SimpleHTTPRequestHandler.translate_path(self, path)
+        return os.path.join(self.server.root, os.path.relpath(path, os.getcwd()))
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StandIn(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """ Serves the files under `root`, delaying each response by `latency` seconds.
+        `counts` has the number of files sent whole ('ok') and of 304s ('not_modified'). """
+
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+    def __init__(self, root, port=0, latency=0.0):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', port), _Handler)
+        self.root = os.path.abspath(root)
+        self.latency = latency
+        self.counts = {'ok': 0, 'not_modified': 0}
+        self.lock = threading.Lock()
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}/'.format(self.server_address[1])
+
+
+def serve(root, port=0, latency=0.0):
+    """Starts a `StandIn` for `root` in a daemon thread, and returns it. `port` 0 picks a free port."""
+    server = StandIn(root, port, latency)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve a directory as a stand-in for GitHub.')
+    parser.add_argument('root', type=str, help='directory to serve')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0.0, help='delay before each response, in seconds')
+    args = parser.parse_args()
+    server = StandIn(args.root, args.port, args.latency)
+    print "Serving", server.root, "at", server.url
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
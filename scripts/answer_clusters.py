@@ -0,0 +1,112 @@
+""" Grouping of identical and nearly identical answers to a prompt.
+
+    Answers are first grouped by their normalized text (whitespace collapsed),
+    which catches exact duplicates with one dictionary lookup each.  Each distinct
+    text is then reduced to a MinHash signature over its token shingles, and the
+    signatures are split into bands: texts that agree on every row of some band
+    land in the same bucket and become candidates, and candidates whose shingle
+    sets are similar enough (Jaccard) are merged.  This finds near duplicates in
+    roughly linear time, instead of comparing every pair of answers.
+"""
+
+import re
+import zlib
+
+import numpy as np
+
+NEAR_DUPLICATE_JACCARD = 0.8  # shingle-set similarity at which two answers are near duplicates
+SHINGLE_SIZE = 3  # tokens per shingle
+BANDS, ROWS = 16, 4  # MinHash signature of BANDS * ROWS hashes
+
+_PRIME = 4294967311  # the first prime above 2 ** 32
+_rng = np.random.RandomState(1)
+_PERMUTATIONS = (_rng.randint(1, 2 ** 32, BANDS * ROWS).astype(np.uint64)[:, np.newaxis],
+                 _rng.randint(0, 2 ** 32, BANDS * ROWS).astype(np.uint64)[:, np.newaxis])
+_TOKEN = re.compile(r'\w+|[^\w\s,.;:!?\'"]+', re.U)  # words and operators; not prose punctuation
+_WHITESPACE = re.compile(r'\s+', re.U)
+
+
+class AnswerCluster(object):
+    """ Answers that are the same or nearly the same.  `members` are the keys of the
+        answers, those with the same text together; the first, the `representative`,
+        is the member that was given to `cluster_answers` first. """
+
+    def __init__(self, members, exact):
+        self.members = members
+        self.exact = exact  # whether every member's normalized text is the same
+
+    @property
+    def representative(self):
+        return self.members[0]
+
+    def __len__(self):
+        return len(self.members)
+
+
+def normalize(text):
+    return _WHITESPACE.sub(u' ', text).strip()
+
+
+def shingles(text):
+    """ Returns the set of hashes of the runs of `SHINGLE_SIZE` words in `text` (or of
+        all of them, if fewer).  Case and punctuation other than operators are ignored. """
+    tokens = _TOKEN.findall(text.lower())
+    count = max(1, len(tokens) - SHINGLE_SIZE + 1)
+    return {zlib.crc32(u' '.join(tokens[i:i + SHINGLE_SIZE]).encode('utf-8')) & 0xffffffff for i in range(count)}
+
+
+def minhash(shingle_set):
+    """Returns the MinHash signature of a set of 32-bit shingle hashes."""
+    a, b = _PERMUTATIONS
+    hashes = np.fromiter(shingle_set, dtype=np.uint64, count=len(shingle_set))[np.newaxis, :]
+    return ((a * hashes + b) % _PRIME).min(axis=1)
+
+
+def jaccard(a, b):
+    return len(a & b) / float(len(a | b)) if a or b else 1.0
+
+
+def cluster_answers(answers, threshold=NEAR_DUPLICATE_JACCARD):
+    """ Given a list of (key, answer text), returns a list of `AnswerCluster`, in the
+        order of their representatives.  With `threshold` None, only exact duplicates
+        (after normalization) are grouped. """
+    by_text = {}  # normalized text -> index into groups
+    groups = []  # [(normalized text, [key])]
+    for key, text in answers:
+        text = normalize(text)
+        if text not in by_text:
+            by_text[text] = len(groups)
+            groups.append((text, []))
+        groups[by_text[text]][1].append(key)
+
+    parent = range(len(groups))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    if threshold is not None and len(groups) > 1:
+        shingle_sets = [shingles(text) for text, _ in groups]
+        buckets = {}
+        for i, shingle_set in enumerate(shingle_sets):
+            signature = minhash(shingle_set)
+            for band in range(BANDS):
+                key = (band, signature[band * ROWS:(band + 1) * ROWS].tostring())
+                first = buckets.setdefault(key, i)
+                # comparing only with the bucket's first text keeps this linear; a near
+                # duplicate missed here nearly always shares another band with that text
+                if first != i and find(first) != find(i) and jaccard(shingle_sets[first], shingle_set) >= threshold:
+                    root_i, root_first = find(i), find(first)
+                    parent[max(root_i, root_first)] = min(root_i, root_first)
+
+    clusters = {}  # root -> AnswerCluster
+    for i, (_, keys) in enumerate(groups):
+        root = find(i)
+        if root not in clusters:
+            clusters[root] = AnswerCluster([], exact=True)
+        cluster = clusters[root]
+        cluster.exact = cluster.exact and (root == i)
+        cluster.members.extend(keys)
+    return [clusters[root] for root in sorted(clusters)]
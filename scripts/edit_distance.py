@@ -0,0 +1,194 @@
+""" Batched, bounded edit distances.
+
+    Matching notebooks is a prompts x cells matrix of edit distances, of which only
+    those up to the matching threshold `k` matter.  `Patterns` computes many of them,
+    from a fixed set of strings, at once: Myers' bit-parallel algorithm, restricted to
+    the 2k + 1 diagonals around the main one (the only cells of the dynamic programming
+    matrix that can hold a distance up to k), is run for all the pairs together with
+    NumPy, one column per step, with each pair's band in one 64-bit word.
+    A pair is dropped as soon as every cell of its band exceeds k, which for most
+    pairs is within a few columns.  Common prefixes and suffixes are stripped first,
+    and once only a few pairs are left they are finished one by one with `Levenshtein`,
+    which is then faster than further steps.
+
+    python-Levenshtein has no cutoff, so `bounded_distance` computes the whole
+    distance and caps it.
+"""
+
+import sys
+
+import Levenshtein
+import numpy as np
+
+# the code units `len` counts: UTF-32 on wide builds, UTF-16 on narrow ones
+_ENCODING, _CODE_UNIT = ('utf-32-le', np.uint32) if sys.maxunicode > 0xFFFF else ('utf-16-le', np.uint16)
+_BYTE_COUNTS = np.array([bin(i).count('1') for i in range(256)], dtype=np.int64)
+_ONE = np.uint64(1)
+
+
+def bounded_distance(a, b, bound):
+    """Return the edit distance between `a` and `b`, or `bound + 1` if it exceeds `bound`."""
+    if abs(len(a) - len(b)) > bound:
+        return bound + 1
+    return min(Levenshtein.distance(a, b), bound + 1)
+
+
+def distance_matrix(queries, sources, bound, candidates=None):
+    """ Returns a len(queries) x len(sources) array of the edit distances between each query
+        and source, with distances over `bound` reported as `bound + 1`.
+
+        If `candidates`, a boolean array of the same shape, is given, only those pairs are
+        computed; the others are reported as `bound + 1`. """
+    matrix = np.full((len(queries), len(sources)), bound + 1, dtype=np.int32)
+    q_lengths = np.array([len(q) for q in queries], dtype=np.int32)
+    s_lengths = np.array([len(s) for s in sources], dtype=np.int32)
+    mask = np.abs(q_lengths[:, np.newaxis] - s_lengths[np.newaxis, :]) <= bound
+    if candidates is not None:
+        mask &= candidates
+    for q, s in zip(*np.nonzero(mask)):
+        matrix[q, s] = bounded_distance(queries[q], sources[s], bound)
+    return matrix
+
+
+def _flat_codes(strings):
+    """Returns the code units of `strings` concatenated, the offset of each string, and their lengths."""
+    lengths = np.array([len(s) for s in strings], dtype=np.int64)
+    offsets = np.zeros(len(strings), dtype=np.int64)
+    np.cumsum(lengths[:-1], out=offsets[1:])
+    codes = np.frombuffer(u''.join(strings).encode(_ENCODING), dtype=_CODE_UNIT).astype(np.int64)
+    return codes, offsets, lengths
+
+
+def _popcount(words):
+    return _BYTE_COUNTS[words.view(np.uint8)].reshape(len(words), 8).sum(axis=1)
+
+
+def _common_run(a_codes, a_starts, b_codes, b_starts, lengths, step):
+    """ Returns the number of equal code units of each pair of strings, read from `a_starts`
+        and `b_starts` forward (`step` 1) or backward (`step` -1), up to `lengths`. """
+    run = np.zeros_like(lengths)
+    pending = np.flatnonzero(lengths)
+    width = 16
+    while len(pending):
+        offsets = run[pending, np.newaxis] + np.arange(width)
+        same = (offsets < lengths[pending, np.newaxis]) \
+            & (a_codes.take(a_starts[pending, np.newaxis] + step * offsets, mode='clip')
+               == b_codes.take(b_starts[pending, np.newaxis] + step * offsets, mode='clip'))
+        matched = np.where(same.all(axis=1), width, same.argmin(axis=1))
+        run[pending] += matched
+        pending = pending[(matched == width) & (run[pending] < lengths[pending])]
+        width *= 4
+    return run
+
+
+class Patterns(object):
+    """ A fixed set of strings, prepared to be compared with many others within `bound` edits.
+
+        For each string and each of its characters, the positions of the character are
+        kept as a bit vector, and every window of 2 * bound + 1 bits of it as one word,
+        so the band of a comparison is read with a single lookup. """
+
+    MIN_BATCH = 128  # fewer pairs than this are finished with `Levenshtein`
+    CHECK_EVERY = 4  # columns between checks for pairs past the bound
+
+    def __init__(self, strings, bound):
+        if not 0 <= bound <= 31:
+            raise ValueError("bound must be between 0 and 31: {}".format(bound))
+        self.bound = bound
+        width = 2 * bound + 1
+        self.strings = list(strings)
+        self.codes, self.offsets, self.lengths = _flat_codes(self.strings)
+        chars = np.unique(self.codes)
+        # characters are numbered from 1; 0 is for those in none of the strings
+        self.char_ids = np.zeros(int(chars[-1]) + 2 if len(chars) else 1, dtype=np.int64)
+        self.char_ids[chars] = np.arange(1, len(chars) + 1)
+        self.n_chars = len(chars) + 1
+        owner = np.repeat(np.arange(len(self.strings)), self.lengths)
+        keys, key_rows = np.unique(owner * self.n_chars + self.char_ids[self.codes], return_inverse=True)
+        # rows[string * n_chars + char]: the row of `windows` of that character in that string (0: none)
+        self.rows = np.zeros(len(self.strings) * self.n_chars, dtype=np.int64)
+        self.rows[keys] = np.arange(1, len(keys) + 1)
+        # bit x + bound + 1 of a row is set where the character is at position x
+        self.stride = int(self.lengths.max() if len(self.strings) else 0) + bound + 1 + width
+        bits = np.zeros((len(keys) + 1, self.stride + width), dtype=np.uint64)
+        bits[key_rows + 1, np.arange(len(self.codes)) - self.offsets[owner] + bound + 1] = 1
+        # windows[row, x]: bits x to x + width - 1 of the row
+        self.windows = np.zeros((len(keys) + 1, self.stride), dtype=np.uint64)
+        for t in range(width):
+            self.windows |= bits[:, t:t + self.stride] << np.uint64(t)
+        self.windows = self.windows.ravel()
+
+    def distances(self, texts, string_index, text_index):
+        """ Returns an array of the edit distances between self.strings[string_index[i]] and
+            texts[text_index[i]], with distances over the bound reported as bound + 1. """
+        k = self.bound
+        width = 2 * k + 1
+        result = np.full(len(string_index), k + 1, dtype=np.int32)
+        m = self.lengths[string_index]
+        n = np.array([len(text) for text in texts], dtype=np.int64)[text_index]
+        live = np.flatnonzero(np.abs(m - n) <= k)
+        if not len(live):
+            return result
+        t_codes, t_offsets, _ = _flat_codes(texts)
+        m, n = m[live], n[live]
+        s_starts, t_starts = self.offsets[string_index[live]], t_offsets[text_index[live]]
+        # a common prefix and suffix leave the distance unchanged
+        prefix = _common_run(self.codes, s_starts, t_codes, t_starts, np.minimum(m, n), 1)
+        suffix = _common_run(self.codes, s_starts + m - 1, t_codes, t_starts + n - 1,
+                             np.minimum(m, n) - prefix, -1)
+        m, n = m - prefix - suffix, n - prefix - suffix
+        settled = (m == 0) | (n == 0)
+        result[live[settled]] = np.maximum(m, n)[settled]
+        rest = np.flatnonzero(~settled)
+        # longest text first, so the pairs still running at any column are a prefix
+        order = rest[np.argsort(-n[rest], kind='mergesort')]
+        live, m, n, prefix = live[order], m[order], n[order], prefix[order]
+        string_rows = string_index[live] * self.n_chars
+        t_chars = self.char_ids.take(t_codes, mode='clip')
+        t_starts = t_starts[order] + prefix - 1
+
+        # Bit t of a pair's vectors in column j is row j - k + t of the matrix.
+        # vp/vn: the vertical differences +1/-1 within the band; the cell above the band,
+        # at row j - k - 1, is `top`, which is k + j minus the columns whose diagonal step
+        # was free (`free`).
+        below = np.uint64((1 << (width - 1)) - 1)
+        bottom = np.uint64(1 << (width - 1))
+        vn = np.full(len(live), (1 << k) - 1, dtype=np.uint64)
+        vp = np.full(len(live), ((1 << width) - 1) ^ ((1 << k) - 1), dtype=np.uint64)
+        free = np.zeros(len(live), dtype=np.uint64)
+        j = 0
+        while True:
+            j += 1
+            running = int(np.searchsorted(-n, -j, side='right'))
+            if running < len(live):
+                # past its last column: the distance is the cell at row m, read down from `top`
+                done = slice(running, None)
+                mask = (_ONE << (m[done] - n[done] + k).astype(np.uint64)) - _ONE
+                top = k + j - 1 - free[done].astype(np.int64)
+                result[live[done]] = np.minimum(top + _popcount(vp[done] & mask) - _popcount(vn[done] & mask),
+                                                k + 1)
+                live, m, n, prefix, string_rows, t_starts = \
+                    live[:running], m[:running], n[:running], prefix[:running], string_rows[:running], \
+                    t_starts[:running]
+                vp, vn, free = vp[:running], vn[:running], free[:running]
+            if len(live) <= self.MIN_BATCH:
+                break
+            eq = self.windows[self.rows[string_rows + t_chars[t_starts + j]] * self.stride + prefix + j]
+            x = eq | vn
+            d0 = (((x & vp) + vp) ^ vp) | x
+            hp = vn | ~(d0 | vp)
+            hn = vp & d0
+            free += d0 & _ONE
+            d0 >>= _ONE
+            vn = hp & d0 & below
+            vp = ((hn | ~(hp | d0)) & below) | bottom
+            if j % self.CHECK_EVERY == 0:
+                # every cell of the band is at least top minus its -1 steps
+                alive = j - free.astype(np.int64) <= _popcount(vn)
+                if not alive.all():
+                    live, m, n, prefix, string_rows, t_starts = \
+                        live[alive], m[alive], n[alive], prefix[alive], string_rows[alive], t_starts[alive]
+                    vp, vn, free = vp[alive], vn[alive], free[alive]
+        for i in live:
+            result[i] = bounded_distance(self.strings[string_index[i]], texts[text_index[i]], k)
+        return result
@@ -6,54 +6,114 @@
 """
 
 import argparse
+import glob
+import hashlib
 import json
 import os
 import re
+import shutil
 import sys
-import urllib
-from collections import OrderedDict
-from copy import deepcopy
+import tempfile
+from collections import OrderedDict, deque
 from multiprocessing import Pool
-from numpy import argmin
-import Levenshtein
+import numpy as np
 import pandas as pd
+from answer_clusters import cluster_answers
+from edit_distance import Patterns
+from extraction_daemon import ExtractionDaemon
+from extraction_state import ExtractionState
+from fetch_engine import FetchEngine
+from git_mirror import GitMirrors
+from notebook_alignment import align
+from notebook_cache import DEFAULT_MAX_BYTES, NotebookCache
+from notebook_stream import compact_cell
+from notebook_writer import dump_notebook
+from output_filter import add_output_arguments, output_filter_from_args
+from run_profile import RunProfile
+from status_store import NO_NOTEBOOK, STATUS_CODES, AssignmentStatus, StatusStore
 
 PROJECT_DIR = os.path.relpath(os.path.join(os.path.dirname(__file__), '..'))
+GITHUB_URL = "http://github.com/"
+RAW_GITHUB_URL = "https://raw.githubusercontent.com/"
+CLONE_URL = "https://github.com/"
 
 
-def read_json_from_url(url):
-    """Given an URL, return its contents as JSON; or None if no JSON exists at that URL.
+class Roster(object):
+    """ The class list, indexed once: github username -> full name, and the
+        usernames sorted by full name, which is the order reports are written in. """
 
-    Prints exceptions except 404.
+    def __init__(self, users_df):
+        self.fullnames = {}
+        for gh_username, fullname in zip(users_df['gh_username'], users_df['Full Name']):
+            self.fullnames.setdefault(gh_username, fullname)
+        self.usernames = list(users_df['gh_username'])
+        self.sorted_usernames = sorted(self.usernames, key=self.fullnames.__getitem__)
 
-    This is a global function so that it can be used as an argument to `p.map`"""
-
-    fid = urllib.urlopen(url)
-    try:
-        if 200 <= fid.getcode() <= 299:
-            return json.load(fid)
-    except Exception as ex:
-        print >> sys.stderr, "error loading {}: {}".format(url, ex)
-    finally:
-        fid.close()
-    return None
+    def fullname(self, gh_username):
+        return self.fullnames[gh_username]
 
 
 class NotebookExtractor(object):
-    """ The top-level class for extracting answers from a notebook.
-        TODO: add support multiple notebooks
-    """
+    """ The top-level class for extracting answers from the notebooks of a class, for one template. """
 
     MATCH_THRESH = 10  # maximum edit distance to consider something a match
+    MATCH_CHUNK = 32  # notebooks matched together
+    MATCH_WINDOW = 1  # chunks in flight per matching process
 
-    def __init__(self, users_df, notebook_template_file, include_usernames=False):
-        """ Initialize with the specified notebook URLs and
-            list of question prompts """
+    def __init__(self, users_df, notebook_template_file, include_usernames=False, cache=None,
+                 engine=None, state_dir=None, rebuild_state=False, jobs=1, shard_by=None,
+                 output_filter=None, profile=None, profile_matching=False, align=False, status_dir=None,
+                 mirrors=None):
+        """ Initialize with the specified notebook URLs and list of question prompts.
+            A `NotebookCache` keeps fetched notebooks, their parses and their
+            prompt matches between runs.  Notebooks are fetched with `engine`,
+            a `FetchEngine`.  Each student's results are saved under `state_dir`,
+            and reused while their notebook is unchanged unless `rebuild_state`.
+            Notebooks are matched against the prompts in `jobs` processes.
+            With `shard_by` 'prompt', or a number of students, the summary notebook is
+            split into one notebook per prompt, or per that many students.
+            The cells written are passed through `output_filter`, an `OutputFilter`.
+            Timings and counts are recorded in `profile`, a `RunProfile`, and with
+            `profile_matching` the matching runs under cProfile.  With `align`, each
+            notebook is aligned with the template as a whole (see `NotebookAligner`)
+            instead of each prompt being looked for on its own.  Every student's
+            status for each prompt is saved in the `StatusStore` in `status_dir`.
+            With `mirrors`, a `GitMirrors`, the notebooks are read from it instead of fetched. """
         self.users_df = users_df
+        self.roster = Roster(users_df)
         self.question_prompts = self.build_question_prompts(notebook_template_file)
+        self.align = align
+        if align:
+            self.matcher = NotebookAligner.for_prompts(self.template, self.question_prompts,
+                                                       NotebookExtractor.MATCH_THRESH)
+        else:
+            self.matcher = NotebookMatcher.for_prompts(self.question_prompts, NotebookExtractor.MATCH_THRESH)
         self.include_usernames = include_usernames
+        self.shard_by = shard_by
+        self.output_filter = output_filter
+        self.cache = cache
+        self.profile = profile or RunProfile()
+        self.profile_matching = profile_matching
+        self.engine = engine or FetchEngine(on_response=self.profile.record_response)
+        self.mirrors = mirrors
+        self.interned = {}  # the source lines and other members of the answers' cells, each stored once
+        self.jobs = jobs
         nb_name_full = os.path.split(notebook_template_file)[1]
         self.nb_name_stem = os.path.splitext(nb_name_full)[0]
+        self.state = None
+        if state_dir is not None:
+            self.state = ExtractionState(os.path.join(state_dir, self.nb_name_stem + '.pickle'),
+                                         self.fingerprint, load=not rebuild_state)
+        self.status_store = StatusStore(status_dir) if status_dir is not None else None
+
+    @property
+    def fingerprint(self):
+        """Identifies everything about the template that determines which cells are extracted."""
+        prompts = [(p.question_heading, p.start_md, p.stop_md) for p in self.question_prompts]
+        key = [NotebookExtractor.MATCH_THRESH, prompts]
+        if self.align:
+            key.append(self.matcher.fingerprint)
+        return hashlib.sha1(json.dumps(key)).hexdigest()
 
     def build_question_prompts(self, notebook_template_file):
         """Returns a list of `QuestionPrompt`. Each cell with metadata `is_question` truthy
@@ -85,28 +145,207 @@ class NotebookExtractor(object):
                     prev_prompt = None
         return prompts
 
-    def fetch_notebooks(self):
-        """Returns a dictionary {github_username -> url, json?}.
+    def fetch_responses(self, responses=None, users_df=None):
+        """Returns a dictionary {github_username -> [response cells for each prompt]}.
+
+        Unavailable notebooks have a value of None.  The response cells for a prompt are those
+        `get_closest_match` returns without suppressing non-answer cells.
+
+        Each notebook is parsed as soon as it arrives, while the rest are still downloading;
+        matching serially, it is matched against the prompts then too.
+        `responses`, an iterable of (url, body, digest) as yielded by `fetch_notebook_responses`,
+        replaces the fetch; batch mode uses it to share one fetch between templates.
+        Only the students in `users_df`, a subset of the roster, are fetched if it is given."""
+
+        users_df = self.users_df if users_df is None else users_df
+        urls = users_df['notebook_urls']
+        if responses is None:
+            print "Retrieving %d notebooks" % urls.count()
+            responses = self.profile.iterate('fetch', fetch_notebook_responses(urls, self.cache, self.engine,
+                                                                                      self.mirrors))
+        usernames_by_url = dict(zip(urls, users_df['gh_username']))
+        student_responses = {}
+        notebooks = self.notebooks_to_match(responses, usernames_by_url, student_responses)
+        for url, digest, cells, matches in self.match_notebooks(notebooks):
+            with self.profile.stage('match'):
+                # only the answers' cells are kept, compacted, so the notebook can be released
+                student_responses[url] = [[compact_cell(cell, self.interned)
+                                           for cell in prompt.get_closest_match(cells, NotebookExtractor.MATCH_THRESH,
+                                                                                False, matches)]
+                                          for prompt in self.question_prompts]
+            if self.state is not None:
+                self.state.put(usernames_by_url[url], digest, student_responses[url])
+        self.profile.count('notebooks', len(urls))
+        self.profile.count('notebooks_unavailable', sum(r is None for r in student_responses.values()))
+        if self.state is not None:
+            self.state.save(self.users_df['gh_username'])
+            self.profile.count('answers_reused', self.state.reused)
+            if self.state.reused:
+                print "Reused saved answers for %d unchanged notebooks" % self.state.reused
+        return dict(zip(users_df['gh_username'], [student_responses[url] for url in urls]))
+
+    def notebooks_to_match(self, responses, usernames_by_url, student_responses):
+        """ Yields (url, digest, cells) for each fetched notebook that has to be matched.
+
+            Unavailable notebooks, and those whose saved answers can be reused,
+            are recorded in `student_responses` instead. """
+        for url, body, digest in responses:
+            student_responses[url] = None
+            if digest is None and body is not None:
+                digest = hashlib.sha1(body).hexdigest()
+            if digest is None:
+                continue
+            if self.state is not None:
+                student_responses[url] = self.state.get(usernames_by_url[url], digest)
+                if student_responses[url] is not None:
+                    continue
+            with self.profile.stage('parse'):
+                if body is not None:
+                    notebook_content = self.read_notebook(url, body)
+                else:
+                    notebook_content = self.load_cached_notebook(url, digest)
+            if notebook_content is not None:
+                yield url, digest, notebook_content['cells']
+
+    def match_notebooks(self, notebooks):
+        """ Given an iterable of (key, digest, cells), yields (key, digest, cells, `CellMatches`).
+
+            The notebooks without cached matches are matched `MATCH_CHUNK` at a time, so the
+            edit distances of a chunk are computed together (see `NotebookMatcher.match_many`).
+            With more than one job, the chunks are spread over a process pool.
+            The workers are sent only the cell sources, and the cells returned are the
+            ones passed in, so the results are the same as matching serially.  At most
+            `MATCH_WINDOW` chunks per job are sent ahead of the one yielded next, so
+            only their cells are held while the rest are still being fetched. """
+        kind = 'matches-' + self.matcher.fingerprint
+        pool = None
+        pending = deque()  # (chunk, AsyncResult) of the chunks sent to the pool, in order
+        try:
+            for chunk in self.chunks_to_match(notebooks, kind):
+                if not isinstance(chunk, list):
+                    yield chunk
+                elif self.jobs <= 1:
+                    for matched in self.store_matches(chunk, self.match_cells([cells for _, _, cells in chunk]),
+                                                      kind):
+                        yield matched
+                else:
+                    if pool is None:
+                        pool = Pool(self.jobs, initializer=_init_match_worker, initargs=(self.matcher,))
+                    sources = [[u''.join(cell['source']) for cell in cells] for _, _, cells in chunk]
+                    pending.append((chunk, pool.apply_async(_match_many, (sources,))))
+                    if len(pending) > self.jobs * self.MATCH_WINDOW:
+                        for matched in self.collect_matches(pending.popleft(), kind):
+                            yield matched
+            while pending:
+                for matched in self.collect_matches(pending.popleft(), kind):
+                    yield matched
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
+    def chunks_to_match(self, notebooks, kind):
+        """ Yields (key, digest, cells, `CellMatches`) for each of the (key, digest, cells) `notebooks`
+            whose matches are cached, and lists of the others' (key, digest, cells), `MATCH_CHUNK` at a time. """
+        chunk = []
+        for key, digest, cells in notebooks:
+            matches = self.cache.load_derived(digest, kind) if self.cache is not None else None
+            if matches is not None:
+                self.profile.count('matches_from_cache')
+                yield key, digest, cells, matches
+                continue
+            chunk.append((key, digest, cells))
+            if len(chunk) == self.MATCH_CHUNK:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def collect_matches(self, pending, kind):
+        """Waits for the matches of a chunk sent to the pool; returns [(key, digest, cells, `CellMatches`)]."""
+        chunk, result = pending
+        with self.profile.stage('match'):
+            matches = result.get()
+        return self.store_matches(chunk, matches, kind)
 
-        Unavailable notebooks have a value of None."""
+    def store_matches(self, chunk, matches, kind):
+        """ Returns [(key, digest, cells, `CellMatches`)] for the (key, digest, cells) of `chunk`
+            and their `matches`, which are counted and cached. """
+        matched = []
+        for (key, digest, cells), notebook_matches in zip(chunk, matches):
+            self.count_matching(cells, notebook_matches)
+            if self.cache is not None:
+                self.cache.store_derived(digest, kind, notebook_matches)
+            matched.append((key, digest, cells, notebook_matches))
+        return matched
 
-        p = Pool(20)  # HTTP fetch parallelism. This number is empirically good.
-        print "Retrieving %d notebooks" % self.users_df['notebook_urls'].count()
-        return dict(zip(self.users_df['gh_username'],
-                        p.map(read_json_from_url, self.users_df['notebook_urls'])))
+    def read_notebook(self, url, raw):
+        """Returns the notebook parsed from `raw`; or None if it isn't one."""
+        try:
+            return json.loads(raw)
+        except Exception as ex:
+            print >> sys.stderr, "error loading {}: {}".format(url, ex)
+            return None
+
+    def load_cached_notebook(self, url, digest):
+        """Returns the parsed notebook whose body the cache holds under `digest`, parsing it at most once."""
+        notebook_content = self.cache.load_derived(digest, 'parsed')
+        if notebook_content is None:
+            raw = self.cache.read(digest)
+            if raw is None:
+                print >> sys.stderr, "error loading {}: it is no longer in the cache".format(url)
+                return None
+            notebook_content = self.read_notebook(url, raw)
+            if notebook_content is not None:
+                self.cache.store_derived(digest, 'parsed', notebook_content)
+        else:
+            self.profile.count('parses_from_cache')
+        return notebook_content
+
+    def match_cells(self, notebooks):
+        """Returns a `CellMatches` for the cells of each of `notebooks`."""
+        with self.profile.stage('match'), self.profile.profile_calls('match', self.profile_matching):
+            return self.matcher.match_many([[u''.join(cell['source']) for cell in cells] for cells in notebooks])
+
+    def count_matching(self, cells, matches):
+        self.profile.count('notebooks_matched')
+        self.profile.count('cells_scanned', len(cells))
+        self.profile.count('edit_distances', matches.distances)
 
     def gh_username_to_fullname(self, gh_username):
-        return self.users_df[users_df['gh_username'] == gh_username]['Full Name'].iloc[0]
+        return self.roster.fullname(gh_username)
 
-    def extract(self):
+    def extract(self, responses=None):
         """ Filter the notebook at the notebook_URL so that it only contains
             the questions and answers to the reading.
+            `responses` are prefetched notebooks; see `fetch_responses`.
         """
+        self.responses = self.fetch_responses(responses)
+        self.collect_answers()
 
-        nbs = self.fetch_notebooks()
-        self.usernames = sorted(self.users_df['gh_username'], key=self.gh_username_to_fullname)
+    def intern_responses(self):
+        """ Rebuilds `interned` from the cells of the current `responses`, sharing their parts,
+            so that it does not keep alive the cells of answers an `update` has replaced. """
+        self.interned = {}
+        for student_responses in self.responses.values():
+            for cells in student_responses or []:
+                cells[:] = [compact_cell(cell, self.interned) for cell in cells]
 
-        users_missing_notebooks = [u for u, notebook_content in nbs.items() if not notebook_content]
+    def update(self, gh_usernames):
+        """ Fetches and extracts the notebooks of the students `gh_usernames` again, and
+            collects the answers anew, with everyone else's as extracted before. """
+        users_df = self.users_df[self.users_df['gh_username'].isin(gh_usernames)]
+        self.responses.update(self.fetch_responses(users_df=users_df))
+        self.collect_answers()
+
+    def collect_answers(self):
+        """Collects each prompt's answers and answer statuses from the extracted `responses`."""
+        self.intern_responses()
+        gh_usernames = self.users_df['gh_username']
+        nbs = dict(zip(gh_usernames, [self.responses[u] for u in gh_usernames]))
+        self.usernames = self.roster.sorted_usernames
+
+        users_missing_notebooks = [u for u, student_responses in nbs.items() if student_responses is None]
         if users_missing_notebooks:
             print "Users missing notebooks:", ', '.join(map(self.gh_username_to_fullname, users_missing_notebooks))
 
@@ -115,16 +354,16 @@ class NotebookExtractor(object):
             # This makes it easier to find students.
             nbs = OrderedDict(sorted(nbs.items(), key=lambda t: t[0].lower()))
 
-        for prompt in self.question_prompts:
+        for prompt_index, prompt in enumerate(self.question_prompts):
+            prompt.answers = OrderedDict()
             prompt.answer_status = {}
-            for gh_username, notebook_content in nbs.items():
-                if notebook_content is None:
+            for gh_username, student_responses in nbs.items():
+                if student_responses is None:
                     continue
-                suppress_non_answer = bool(prompt.answers)
-                response_cells = \
-                    prompt.get_closest_match(notebook_content['cells'],
-                                             NotebookExtractor.MATCH_THRESH,
-                                             suppress_non_answer)
+                response_cells = student_responses[prompt_index]
+                if prompt.answers:
+                    # the question itself is only included with the first answer
+                    response_cells = prompt.without_non_answer_cells(response_cells)
                 if not response_cells:
                     status = 'missed'
                 elif not response_cells[-1]['source'] or not any(c['source'] for c in response_cells):
@@ -155,25 +394,101 @@ class NotebookExtractor(object):
             for prompt in self.question_prompts:
                 prompt.answers = OrderedDict(sorted(prompt.answers.items(), key=lambda t: cell_slines_length(t[1])))
 
+    def write_outputs(self, write_profile=False):
+        """ Writes the summary notebook, the answer counts and the answer clusters,
+            recording each as a stage of the profile, and then with `write_profile`, the profile. """
+        with self.profile.stage('dedupe'):
+            for prompt in self.question_prompts:
+                prompt.answer_clusters
+        with self.profile.stage('write_notebook'):
+            self.write_notebook()
+        with self.profile.stage('write_answer_counts'):
+            self.write_answer_counts()
+        with self.profile.stage('write_answer_clusters'):
+            self.write_answer_clusters()
+        if self.status_store is not None:
+            with self.profile.stage('write_answer_status'):
+                self.write_answer_status()
+        if write_profile:
+            self.write_profile()
+
+    def write_profile(self):
+        """Writes the run profile beside the outputs; see `RunProfile.write`."""
+        if self.cache is not None:
+            self.profile.counters['cache_revalidated'] = self.cache.hits
+            self.profile.counters['cache_fetched'] = self.cache.misses
+        path_stem = os.path.join(PROJECT_DIR, 'processed_notebooks', '%s-profile' % self.nb_name_stem)
+        print "Writing", path_stem + '.json'
+        self.profile.write(path_stem)
+
     def write_notebook(self):
+        """ Writes the summary notebook, cell by cell.  With `shard_by` set, the answers are
+            split over notebooks in a directory named after it, and the summary notebook
+            is an index of links to them. """
         suffix = "_responses_with_names" if self.include_usernames else "_responses"
         output_file = os.path.join(PROJECT_DIR, "processed_notebooks", self.nb_name_stem + suffix + ".ipynb")
-        remove_duplicate_answers = not self.include_usernames
+        if self.shard_by is None:
+            self.dump_notebook(output_file, self.summary_cells(self.question_prompts))
+            return
 
-        filtered_cells = []
-        for prompt in self.question_prompts:
-            answers = prompt.answers_without_duplicates if remove_duplicate_answers else prompt.answers
-            for gh_username, response_cells in answers.items():
-                if self.include_usernames:
-                    filtered_cells.append(
-                        NotebookExtractor.markdown_heading_cell(self.gh_username_to_fullname(gh_username), 4))
-                filtered_cells.extend(response_cells)
-        answer_book = deepcopy(self.template)
-        answer_book['cells'] = filtered_cells
+        shard_dir = os.path.splitext(output_file)[0]
+        index_cells = []
+        for number, (title, prompts, usernames) in enumerate(self.shards(), 1):
+            shard_name = '{:03d}.ipynb'.format(number)
+            shard_file = os.path.join(shard_dir, shard_name)
+            self.dump_notebook(shard_file, self.summary_cells(prompts, usernames))
+            link = '{}/{}'.format(os.path.basename(shard_dir), shard_name)
+            index_cells.append(NotebookExtractor.markdown_cell(u"[{}]({})".format(title, link)))
+        self.dump_notebook(output_file, index_cells)
 
-        print "Writing", output_file
-        with open(output_file, 'wt') as fid:
-            json.dump(answer_book, fid)
+    def dump_notebook(self, path, cells):
+        """Writes a notebook of `cells` to `path`, passing them through `output_filter`."""
+        print "Writing", path
+        if self.output_filter is not None:
+            notebook_dir = os.path.dirname(path)
+            cells = (self.output_filter.apply(cell, notebook_dir) for cell in cells)
+        dump_notebook(path, self.template, cells)
+
+    def shards(self):
+        """ Yields (title, prompts, usernames) for each notebook the summary is split into:
+            one per prompt if `shard_by` is 'prompt', with `usernames` None; otherwise
+            one per `shard_by` students, in the order of their names. """
+        if self.shard_by == 'prompt':
+            for prompt in self.question_prompts:
+                yield u"{} ({} answers)".format(prompt.name, len(prompt.answers)), [prompt], None
+            return
+        usernames = self.roster.sorted_usernames
+        for start in range(0, len(usernames), self.shard_by):
+            chunk = usernames[start:start + self.shard_by]
+            title = u"Students {}-{}: {} to {}".format(start + 1, start + len(chunk),
+                                                       self.gh_username_to_fullname(chunk[0]),
+                                                       self.gh_username_to_fullname(chunk[-1]))
+            yield title, self.question_prompts, set(chunk)
+
+    def summary_cells(self, prompts, usernames=None):
+        """ Yields the cells of the summary of the answers to `prompts`, given by the students
+            in `usernames` if it isn't None.  Without user names, each cluster of identical
+            and similar answers is shown once, followed by its size. """
+        for prompt in prompts:
+            if self.include_usernames:
+                groups = [(gh_username, None) for gh_username in prompt.answers]
+            else:
+                groups = [(cluster.representative, cluster) for cluster in prompt.answer_clusters]
+            # the question is included with the first answer; a shard without that answer shows it on its own
+            question_shown = usernames is None or next(iter(prompt.answers), None) in usernames
+            for gh_username, cluster in groups:
+                if usernames is not None and gh_username not in usernames:
+                    continue
+                if not question_shown:
+                    yield NotebookExtractor.markdown_cell(prompt.start_md)
+                    question_shown = True
+                if self.include_usernames:
+                    yield NotebookExtractor.markdown_heading_cell(self.gh_username_to_fullname(gh_username), 4)
+                for cell in prompt.answers[gh_username]:
+                    yield cell
+                if cluster is not None and len(cluster) > 1:
+                    yield NotebookExtractor.markdown_cell(u"*{} {} answers*".format(
+                        len(cluster), "identical" if cluster.exact else "similar"))
 
     def write_answer_counts(self):
         output_file = os.path.join(PROJECT_DIR, 'processed_notebooks', '%s-answer-counts.csv' % self.nb_name_stem)
@@ -190,15 +505,49 @@ class NotebookExtractor(object):
         print df['Total']
         df.to_csv(output_file)
 
+    def answer_status(self):
+        """Returns the `AssignmentStatus` of every student on the roster, for every prompt."""
+        students = list(OrderedDict.fromkeys(self.usernames))
+        rows = {u: i for i, u in enumerate(students)}
+        codes = np.full((len(students), len(self.question_prompts)), NO_NOTEBOOK, dtype=np.int8)
+        for p, prompt in enumerate(self.question_prompts):
+            for gh_username, status in prompt.answer_status.items():
+                codes[rows[gh_username], p] = STATUS_CODES[status]
+        return AssignmentStatus(students, [prompt.name for prompt in self.question_prompts], codes,
+                                [not (prompt.is_optional or prompt.is_poll) for prompt in self.question_prompts])
+
+    def write_answer_status(self):
+        print "Writing", self.status_store.path(self.nb_name_stem)
+        self.status_store.put(self.nb_name_stem, self.answer_status())
+
+    def write_answer_clusters(self):
+        """Writes the clusters of more than one answer, with the names of the students in each."""
+        output_file = os.path.join(PROJECT_DIR, 'processed_notebooks', '%s-answer-clusters.csv' % self.nb_name_stem)
+
+        rows = []
+        for prompt in self.question_prompts:
+            for number, cluster in enumerate(prompt.answer_clusters, 1):
+                if len(cluster) > 1:
+                    rows.append([prompt.name, number, len(cluster), cluster.exact,
+                                 '; '.join(map(self.gh_username_to_fullname, cluster.members))])
+        df = pd.DataFrame(data=rows, columns=['Question', 'Cluster', 'Size', 'Identical', 'Students'])
+
+        print "Writing", output_file
+        df.to_csv(output_file, index=False, encoding='utf-8')
+
     @staticmethod
     def markdown_heading_cell(text, heading_level):
         """ A convenience function to return a markdown cell
             with the specified text at the specified heading_level.
             e.g. mark_down_heading_cell('Notebook Title','#')
         """
+        return NotebookExtractor.markdown_cell(unicode('#' * heading_level + " " + text))
+
+    @staticmethod
+    def markdown_cell(text):
         return {u'cell_type': u'markdown',
                 u'metadata': {},
-                u'source': unicode('#' * heading_level + " " + text)}
+                u'source': text}
 
 
 class QuestionPrompt(object):
@@ -221,18 +570,42 @@ class QuestionPrompt(object):
         self.is_poll = is_poll
         self.index = index
         self.answers = OrderedDict()
+        self._clusters = None  # (answers, number of answers, clusters) when last clustered
+
+    @property
+    def answer_clusters(self):
+        """ The answers grouped into `AnswerCluster`s of identical and nearly identical ones.
+            Computed once, and again only if answers are added. """
+        if self._clusters is None or self._clusters[0] is not self.answers \
+                or self._clusters[1] != len(self.answers):
+            texts = []
+            for idx, (username, response_cells) in enumerate(self.answers.items()):
+                if idx == 0:
+                    # the first answer carries the question
+                    response_cells = self.without_non_answer_cells(response_cells)
+                texts.append((username, u'\n'.join(u''.join(cell['source']) for cell in response_cells)))
+            self._clusters = (self.answers, len(self.answers), cluster_answers(texts))
+        return self._clusters[2]
 
     @property
     def answers_without_duplicates(self):
-        answers = dict(self.answers)
-        answer_strings = set()  # answers to this question, as strings; used to avoid duplicates
-        for username, response_cells in self.answers.items():
-            answer_string = '\n'.join(u''.join(cell['source']) for cell in response_cells).strip()
-            if answer_string in answer_strings:
-                del answers[username]
-            else:
-                answer_strings.add(answer_string)
-        return answers
+        """The answer of each cluster's representative."""
+        return OrderedDict((cluster.representative, self.answers[cluster.representative])
+                           for cluster in self.answer_clusters)
+
+    def without_non_answer_cells(self, response_cells):
+        """ Returns `response_cells`, as returned by `get_closest_match`, less the cells
+            that `suppress_non_answer_cells` would have omitted. """
+        if not response_cells:
+            return response_cells
+        return response_cells[1 + bool(self.question_heading):]
+
+    @property
+    def match_queries(self):
+        """The strings this prompt searches for among a notebook's cells."""
+        if self.stop_md in (u"next_cell", u""):
+            return [self.start_md]
+        return [self.start_md, self.stop_md]
 
     @property
     def name(self):
@@ -250,28 +623,29 @@ class QuestionPrompt(object):
     def get_closest_match(self,
                           cells,
                           matching_threshold,
-                          suppress_non_answer_cells=False):
+                          suppress_non_answer_cells=False,
+                          matches=None):
         """ Returns a list of cells that most closely match
             the question prompt.  If no match is better than
             the matching_threshold, the empty list will be
-            returned. """
+            returned.  `matches` is the result of `NotebookMatcher.match`
+            over the same cells; pass it to reuse one index across prompts. """
         return_value = []
-        distances = [Levenshtein.distance(self.start_md, u''.join(cell['source']))
-                     for cell in cells]
-        if min(distances) > matching_threshold:
+        if matches is None:
+            matches = NotebookMatcher(self.match_queries, matching_threshold).match(cells)
+        best_match = matches.closest(self.start_md)
+        if best_match is None:
             return return_value
 
-        best_match = argmin(distances)
         if self.stop_md == u"next_cell":
             end_offset = 2
         elif len(self.stop_md) == 0:
             end_offset = len(cells) - best_match
         else:
-            distances = [Levenshtein.distance(self.stop_md, u''.join(cell['source']))
-                         for cell in cells[best_match:]]
-            if min(distances) > matching_threshold:
+            stop_match = matches.closest(self.stop_md, best_match)
+            if stop_match is None:
                 return return_value
-            end_offset = argmin(distances)
+            end_offset = stop_match - best_match
         if len(self.question_heading) != 0 and not suppress_non_answer_cells:
             return_value.append(NotebookExtractor.markdown_heading_cell(self.question_heading, 2))
         if not suppress_non_answer_cells:
@@ -280,48 +654,379 @@ class QuestionPrompt(object):
         return return_value
 
 
-def validate_github_username(gh_name):
-    """Return `gh_name` if that Github user has a `repo_name` repository; else None."""
-    fid = urllib.urlopen("http://github.com/" + gh_name)
-    fid.close()
-    return gh_name if 200 <= fid.getcode() <= 299 else None
+_worker_matcher = None  # the `NotebookMatcher` of a matching worker process
 
 
-def validate_github_usernames(gh_usernames, repo_name):
+def _init_match_worker(matcher):
+    global _worker_matcher
+    _worker_matcher = matcher
+
+
+def _match_many(notebooks):
+    return _worker_matcher.match_many(notebooks)
+
+
+class CellMatches(object):
+    """ The cells of one notebook that lie within the matching threshold of each query.
+
+        `hits` maps a query string to a list of (cell index, distance) in cell order. """
+
+    def __init__(self, hits, distances=0):
+        self.hits = hits
+        self.distances = distances  # the number of (query, cell) edit distances looked at to find them
+
+    def closest(self, query, start=0):
+        """ Returns the index of the first cell at or after `start` with the smallest
+            distance to `query`, the same cell `argmin` picks over `cells[start:]`;
+            or None if no such cell is within the matching threshold. """
+        best_idx, best_dist = None, None
+        for idx, dist in self.hits.get(query, ()):
+            if idx >= start and (best_dist is None or dist < best_dist):
+                best_idx, best_dist = idx, dist
+                if dist == 0:
+                    break
+        return best_idx
+
+
+class NotebookMatcher(object):
+    """ An index over a fixed set of query strings (the prompts' start and stop markdown)
+        which resolves all of them against notebooks in one pass over their cells.
+
+        Each cell is compared only against queries whose length is within the threshold
+        of the cell's length, and each distinct cell source once per batch of notebooks.
+        The edit distances of those pairs are computed together, bounded by the threshold,
+        by `Patterns`, which is prepared once for the queries.
+    """
+
+    def __init__(self, queries, matching_threshold):
+        self.matching_threshold = matching_threshold
+        self.queries = sorted(set(queries), key=len)
+        self.query_lengths = np.array([len(q) for q in self.queries], dtype=np.int64)
+        self.patterns = Patterns(self.queries, matching_threshold)
+        self.fingerprint = hashlib.sha1(json.dumps([matching_threshold, self.queries])).hexdigest()
+
+    @classmethod
+    def for_prompts(cls, prompts, matching_threshold):
+        return cls([query for prompt in prompts for query in prompt.match_queries], matching_threshold)
+
+    def match(self, cells):
+        """Returns a `CellMatches` for `cells`."""
+        return self.match_sources([u''.join(cell['source']) for cell in cells])
+
+    def match_sources(self, sources):
+        """Returns a `CellMatches` for cells with the joined `sources`."""
+        return self.match_many([sources])[0]
+
+    def match_many(self, notebooks):
+        """Returns a `CellMatches` for each of `notebooks`, lists of joined cell sources, matched together."""
+        thresh = self.matching_threshold
+        index = {}
+        notebook_ids = [np.array([index.setdefault(source, len(index)) for source in sources], dtype=np.int64)
+                        for sources in notebooks]
+        texts = sorted(index, key=index.get)
+        text_lengths = np.array([len(text) for text in texts], dtype=np.int64)
+        within = np.abs(self.query_lengths[:, np.newaxis] - text_lengths[np.newaxis, :]) <= thresh
+        distances = np.full(within.shape, thresh + 1, dtype=np.int32)
+        query_index, text_index = np.nonzero(within)
+        distances[query_index, text_index] = self.patterns.distances(texts, query_index, text_index)
+        matches = []
+        for ids in notebook_ids:
+            notebook_distances = distances[:, ids]
+            hits = {}
+            for i, idx in zip(*np.nonzero(notebook_distances <= thresh)):
+                hits.setdefault(self.queries[i], []).append((int(idx), int(notebook_distances[i, idx])))
+            matches.append(CellMatches(hits, int(within[:, ids].sum())))
+        return matches
+
+
+class NotebookAligner(object):
+    """ Resolves the prompts' queries against a notebook through one global alignment
+        of the template's cells with the notebook's (see `notebook_alignment.align`).
+
+        A query is found at the notebook cell that the template cell with its text is
+        aligned with.  The queries of template cells left unaligned, as when a student
+        moves an exercise, are looked for among the unaligned notebook cells with a
+        `NotebookMatcher`.  The result is a `CellMatches`, as from `NotebookMatcher`.
+    """
+
+    def __init__(self, template_sources, queries, matching_threshold):
+        self.matching_threshold = matching_threshold
+        self.queries = sorted(set(queries), key=len)
+        # empty template cells are where students answer, so they don't align with anything
+        self.template_sources = [source for source in template_sources if source]
+        self.fingerprint = hashlib.sha1(json.dumps(['align', matching_threshold, self.template_sources,
+                                                    self.queries])).hexdigest()
+
+    @classmethod
+    def for_prompts(cls, template, prompts, matching_threshold):
+        return cls([u''.join(cell['source']) for cell in template['cells']],
+                   [query for prompt in prompts for query in prompt.match_queries], matching_threshold)
+
+    def match(self, cells):
+        """Returns a `CellMatches` for `cells`."""
+        return self.match_sources([u''.join(cell['source']) for cell in cells])
+
+    def match_many(self, notebooks):
+        """Returns a `CellMatches` for each of `notebooks`, lists of joined cell sources."""
+        return [self.match_sources(sources) for sources in notebooks]
+
+    def match_sources(self, sources):
+        """Returns a `CellMatches` for cells with the joined `sources`."""
+        aligned, distances = align(self.template_sources, sources, self.matching_threshold)
+        queries = set(self.queries)
+        hits = {}
+        for i, j, dist in aligned:
+            if self.template_sources[i] in queries:
+                hits.setdefault(self.template_sources[i], []).append((j, dist))
+        for query_hits in hits.values():
+            query_hits.sort()
+        unaligned_queries = [query for query in self.queries if query not in hits]
+        if unaligned_queries:
+            aligned_cells = set(j for _, j, _ in aligned)
+            free = [j for j in range(len(sources)) if j not in aligned_cells]
+            matches = NotebookMatcher(unaligned_queries, self.matching_threshold).match_sources(
+                [sources[j] for j in free])
+            for query, query_hits in matches.hits.items():
+                hits[query] = [(free[idx], dist) for idx, dist in query_hits]
+            distances += matches.distances
+        return CellMatches(hits, distances)
+
+
+def fetch_notebook_responses(urls, cache=None, engine=None, mirrors=None):
+    """Yields (url, body, digest) for each of `urls`, as it arrives.
+
+    Without a cache, `body` is the notebook text, or None if it is unavailable.
+    With a `NotebookCache`, `body` is None and `digest` names the cached body, or is None
+    if the notebook is unavailable.
+    With `GitMirrors`, the notebooks are read from the mirrors instead, and `digest` is the
+    notebook's blob hash."""
+    if mirrors is not None:
+        for response in mirrors.fetch_notebooks(urls):
+            yield response
+        return
+    engine = engine or FetchEngine()
+    if cache is None:
+        for response in engine.fetch((url, {}) for url in urls):
+            yield response.url, response.body if response.ok else None, None
+    else:
+        for url, status, digest in cache.fetch(urls, engine):
+            yield url, None, digest if status is not None and 200 <= status <= 299 else None
+
+
+def validate_github_usernames(gh_usernames, repo_name, cache=None, engine=None, github_url=GITHUB_URL,
+                              mirrors=None):
     """Returns a set of valid github usernames.
 
     A name is valid iff a GitHub user with that name exists, and owns a repository named `repo_name`.
 
     `gh_usernames_path` is a path to a CSV file with a `gh_username` column.
 
+    With a `NotebookCache`, profiles that are unchanged since the last run are confirmed by
+    conditional requests, or, offline, taken from the cache.
+    With `GitMirrors`, a name is valid iff its repository could be mirrored.
+
     Prints invalid names as errors."""
-    p = Pool(20)
-    valid_usernames = filter(None, p.map(validate_github_username, gh_usernames))
+    if mirrors is not None:
+        available = mirrors.update(gh_usernames, repo_name)
+        valid_usernames = [u for u in gh_usernames if available[u]]
+    else:
+        engine = engine or FetchEngine()
+        profile_urls = [github_url + u for u in gh_usernames]
+        if cache is None:
+            statuses = {r.url: r.status for r in engine.fetch((url, {}) for url in profile_urls)}
+        else:
+            statuses = {url: status for url, status, _ in cache.fetch(profile_urls, engine, keep_body=False)}
+        valid_usernames = [u for u, url in zip(gh_usernames, profile_urls)
+                           if 200 <= (statuses[url] or 0) <= 299]
     invalid_usernames = set(gh_usernames) - set(valid_usernames)
     if invalid_usernames:
         print >> sys.stderr, "Invalid github username(s):", ', '.join(invalid_usernames)
     return valid_usernames
 
 
-def get_github_user_raw_repo_url(gh_username, repo_name):
-    return "https://raw.githubusercontent.com/{username}/{repo_name}".format(username=gh_username, repo_name=repo_name)
+def get_github_user_raw_repo_url(gh_username, repo_name, raw_github_url=RAW_GITHUB_URL):
+    return "{raw_github_url}{username}/{repo_name}".format(raw_github_url=raw_github_url,
+                                                           username=gh_username, repo_name=repo_name)
 
 
-def get_github_user_notebook_url(gh_username, template_nb_path, repo_name):
+def get_github_user_notebook_url(gh_username, template_nb_path, repo_name, raw_github_url=RAW_GITHUB_URL):
     m = re.match(r'.*chap(\d+)ex.ipynb', template_nb_path)
     assert m, "template file must include chap\d+ex.ipynb"
     notebook_number = m.group(1)
     notebook_filename = "ThinkStats2/chap{}ex.ipynb".format(notebook_number)
-    repo_url = get_github_user_raw_repo_url(gh_username, repo_name)
+    repo_url = get_github_user_raw_repo_url(gh_username, repo_name, raw_github_url)
     return "{repo_url}/{branch}/{path}".format(repo_url=repo_url, branch="master", path=notebook_filename)
 
+def expand_template_paths(patterns):
+    """Returns the template notebooks named by `patterns`, expanding any globs, without repeats."""
+    paths = []
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern)) or [pattern]:
+            if path not in paths:
+                paths.append(path)
+    return paths
+
+
+def make_extractors(users_df, template_paths, repo_name, raw_github_url=RAW_GITHUB_URL, **extractor_args):
+    """Returns a `NotebookExtractor` for each template, each with its own copy of the roster and notebook URLs."""
+    extractors = []
+    for template_nb_path in template_paths:
+        template_users_df = users_df.copy()
+        template_users_df['notebook_urls'] = [get_github_user_notebook_url(u, template_nb_path, repo_name,
+                                                                           raw_github_url)
+                                              for u in users_df['gh_username']]
+        extractors.append(NotebookExtractor(template_users_df, template_nb_path, **extractor_args))
+    return extractors
+
+
+_batch_jobs = []  # (extractor, responses, write_profile) for each template; inherited by the batch workers
+
+
+def spool_responses(responses, directory):
+    """ Returns {url -> (url, path, digest)} for the (url, body, digest) `responses`, with each
+        body written to a file `path` in `directory` (None if the body is), so that a batch
+        keeps the notebooks it fetched on disk, not in memory, until every template has read them. """
+    spooled = {}
+    for url, body, digest in responses:
+        path = None
+        if body is not None:
+            path = os.path.join(directory, str(len(spooled)))
+            with open(path, 'wb') as fid:
+                fid.write(body)
+        spooled[url] = (url, path, digest)
+    return spooled
+
+
+def unspool_responses(spooled, urls):
+    """Yields (url, body, digest) for each of `urls`, from the files of `spool_responses`."""
+    for url in urls:
+        url, path, digest = spooled[url]
+        if path is None:
+            yield url, None, digest
+        else:
+            with open(path, 'rb') as fid:
+                yield url, fid.read(), digest
+
+
+def _run_batch_job(index):
+    """Extracts and writes one template of a batch. Returns the cache entries it derived."""
+    nbe, responses, write_profile = _batch_jobs[index]
+    nbe.extract(responses)
+    nbe.write_outputs(write_profile)
+    return nbe.cache.derived_records if nbe.cache is not None else []
+
+
+def run_batch(users_df, template_paths, repo_name, jobs=1, cache=None, engine=None, raw_github_url=RAW_GITHUB_URL,
+              profile=None, write_profiles=False, mirrors=None, **extractor_args):
+    """ Extracts answers for several template notebooks in one run.
+
+        The notebooks of every template are fetched together through one `engine`
+        (or read from `mirrors`, a `GitMirrors`), and kept on disk, in the cache or
+        in a temporary directory, then each template is extracted and written in its
+        own process, `jobs` at a time.
+        A single template is matched in `jobs` processes instead.
+        The fetch is recorded in `profile`, and each template's extraction in a `RunProfile`
+        of its own, which is written beside its outputs if `write_profiles`. """
+    profile = profile or RunProfile()
+    engine = engine or FetchEngine(on_response=profile.record_response)
+    # templates run in parallel, in daemonic pool processes, which may not start pools of their own
+    student_jobs = 1 if jobs > 1 and len(template_paths) > 1 else jobs
+    extractors = make_extractors(users_df, template_paths, repo_name, raw_github_url, cache=cache, engine=engine,
+                                 jobs=student_jobs, mirrors=mirrors, **extractor_args)
+
+    urls = [url for nbe in extractors for url in nbe.users_df['notebook_urls']]
+    print "Retrieving %d notebooks for %d templates" % (len(urls), len(extractors))
+    spool_dir = tempfile.mkdtemp(prefix='notebooks-')
+    try:
+        responses = spool_responses(profile.iterate('fetch', fetch_notebook_responses(urls, cache, engine, mirrors)),
+                                    spool_dir)
+        del _batch_jobs[:]
+        _batch_jobs.extend((nbe, unspool_responses(responses, nbe.users_df['notebook_urls']), write_profiles)
+                           for nbe in extractors)
+        if jobs > 1 and len(extractors) > 1:
+            pool = Pool(min(jobs, len(extractors)))
+            derived_records = pool.map(_run_batch_job, range(len(extractors)))
+            pool.close()
+        else:
+            derived_records = map(_run_batch_job, range(len(extractors)))
+    finally:
+        shutil.rmtree(spool_dir)
+    if cache is not None:
+        # only now may the cache evict what the batch fetched
+        for records in derived_records:
+            cache.add_derived_records(records)
+        cache.save()
+
+
+def shard_spec(value):
+    """Parses the --shard-by option: 'prompt', or a positive number of students."""
+    if value == 'prompt':
+        return value
+    if value.isdigit() and int(value) > 0:
+        return int(value)
+    raise argparse.ArgumentTypeError("expected 'prompt' or a number of students, not %r" % value)
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Summarize a set of Jupyter notebooks.')
     parser.add_argument('--repo', type=str, default='DataScience16', help='Github repository name')
     parser.add_argument('--include-usernames', action='store_true', help='include user names in the summary notebook')
+    parser.add_argument('--shard-by', type=shard_spec, metavar='prompt|N',
+                        help='split the summary into a notebook per prompt, or per N students, with an index')
+    add_output_arguments(parser)
+    parser.add_argument('--cache-dir', type=str, default=os.path.join(PROJECT_DIR, '.notebook_cache'),
+                        help='directory for cached notebooks and profile checks')
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_MAX_BYTES // 2 ** 20,
+                        help='maximum cache size, in MB')
+    parser.add_argument('--no-cache', action='store_true', help='always fetch everything')
+    parser.add_argument('--offline', action='store_true', help='serve everything from the cache; make no requests')
+    parser.add_argument('--connections', type=int, default=20, help='maximum number of concurrent requests')
+    parser.add_argument('--connections-per-host', type=int, default=10,
+                        help='maximum number of concurrent requests to one host')
+    parser.add_argument('--timeout', type=float, default=30, help='request timeout, in seconds')
+    parser.add_argument('--retries', type=int, default=3, help='retries of a request that fails with 429 or 5xx')
+    parser.add_argument('--github-url', type=str, default=GITHUB_URL,
+                        help='base URL of GitHub profiles, for checking usernames')
+    parser.add_argument('--raw-github-url', type=str, default=RAW_GITHUB_URL,
+                        help='base URL of raw GitHub files, for fetching notebooks')
+    parser.add_argument('--git-mirrors', type=str, metavar='DIR',
+                        help="keep mirrors of the students' repositories in DIR, and read notebooks from them")
+    parser.add_argument('--clone-url', type=str, default=CLONE_URL,
+                        help='URL the repositories are mirrored from, followed by <username>/<repo>')
+    parser.add_argument('--deadline', type=str,
+                        help='with --git-mirrors, read notebooks as of the last commit before this date')
     parser.add_argument('gh_users', type=str, metavar='GH_USERNAME_CSV_FILE')
-    parser.add_argument('template_notebook', type=str, metavar='JUPYTER_NOTEBOOK_FILE')
+    parser.add_argument('--state-dir', type=str, default=os.path.join(PROJECT_DIR, '.extraction_state'),
+                        help="directory for each student's saved answers, reused while their notebook is unchanged")
+    parser.add_argument('--status-dir', type=str, default=os.path.join(PROJECT_DIR, '.answer_status'),
+                        help="directory of the term's answer statuses, queried with status_store.py")
+    parser.add_argument('--full', action='store_true', help='re-extract every notebook, ignoring saved answers')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='number of worker processes for matching (or, in batch mode, for templates); '
+                             'worth raising when matching, not fetching and parsing, is the slow part')
+    parser.add_argument('--profile', action='store_true',
+                        help='write a profile of the run (time and memory per stage, counts) beside the outputs')
+    parser.add_argument('--profile-matching', action='store_true',
+                        help='also profile the matching with cProfile; implies --jobs 1')
+    parser.add_argument('--serve', type=int, metavar='PORT',
+                        help='after extracting, stay running and re-extract the students named by POSTs to PORT; '
+                             'needs --git-mirrors')
+    parser.add_argument('--align', action='store_true',
+                        help='find the prompts by aligning each notebook with the whole template, like a diff')
+    parser.add_argument('template_notebooks', type=str, nargs='+', metavar='JUPYTER_NOTEBOOK_FILE',
+                        help='template notebooks, or glob patterns matching them')
     args = parser.parse_args()
+    if args.offline and args.no_cache:
+        parser.error('--offline needs the cache')
+    if args.deadline and not args.git_mirrors:
+        parser.error('--deadline needs --git-mirrors')
+    if args.serve is not None and not args.git_mirrors:
+        # raw.githubusercontent.com serves a branch's files from a cache for minutes after a
+        # push, so an update fetched from it right away would find the notebook unchanged
+        parser.error('--serve needs --git-mirrors')
+    if args.profile_matching:
+        args.profile = True
+        args.jobs = 1  # the matching must run in this process to be profiled
 
     repo_name = args.repo
     users_df = pd.read_csv(args.gh_users)
@@ -329,13 +1034,57 @@ if __name__ == '__main__':
 
     # exit()
 
-    valid_github_usernames = validate_github_usernames(users_df['gh_username'], repo_name)
+    cache = None
+    if not args.no_cache:
+        cache = NotebookCache(args.cache_dir, max_bytes=args.cache_size * 2 ** 20, offline=args.offline)
+
+    profile = RunProfile()
+    engine = FetchEngine(concurrency=args.connections, per_host=args.connections_per_host,
+                         timeout=args.timeout, retries=args.retries, on_response=profile.record_response)
+    mirrors = None
+    if args.git_mirrors:
+        mirrors = GitMirrors(args.git_mirrors, args.clone_url, args.raw_github_url, deadline=args.deadline,
+                             jobs=args.connections)
+    with profile.stage('validation'):
+        valid_github_usernames = validate_github_usernames(users_df['gh_username'], repo_name,
+                                                           cache=cache, engine=engine, github_url=args.github_url,
+                                                           mirrors=mirrors)
     users_df['valid_github_repo'] = [u in valid_github_usernames for u in users_df['gh_username']]
 
-    template_nb_path = args.template_notebook
-    users_df['notebook_urls'] = [get_github_user_notebook_url(u, template_nb_path, repo_name)
-                                 for u in users_df['gh_username']]
-    nbe = NotebookExtractor(users_df, template_nb_path, include_usernames=args.include_usernames)
-    nbe.extract()
-    nbe.write_notebook()
-    nbe.write_answer_counts()
+    output_filter = output_filter_from_args(args, os.path.join(PROJECT_DIR, 'processed_notebooks'))
+    template_paths = expand_template_paths(args.template_notebooks)
+    if args.serve is not None:
+        daemon = ExtractionDaemon(make_extractors(users_df, template_paths, repo_name, args.raw_github_url,
+                                                  include_usernames=args.include_usernames, shard_by=args.shard_by,
+                                                  output_filter=output_filter,
+                                                  cache=cache, engine=engine, state_dir=args.state_dir,
+                                                  rebuild_state=args.full, jobs=args.jobs,
+                                                  profile_matching=args.profile_matching, align=args.align,
+                                                  status_dir=args.status_dir, mirrors=mirrors),
+                                  repo_name, write_profiles=args.profile)
+        daemon.extract_all()
+        daemon.serve(args.serve)
+    elif len(template_paths) > 1:
+        run_batch(users_df, template_paths, repo_name, jobs=args.jobs, cache=cache, engine=engine,
+                  raw_github_url=args.raw_github_url, profile=profile, write_profiles=args.profile,
+                  include_usernames=args.include_usernames, shard_by=args.shard_by, output_filter=output_filter,
+                  state_dir=args.state_dir, rebuild_state=args.full,
+                  profile_matching=args.profile_matching, align=args.align, status_dir=args.status_dir,
+                  mirrors=mirrors)
+        if args.profile:
+            path_stem = os.path.join(PROJECT_DIR, 'processed_notebooks', 'batch-profile')
+            print "Writing", path_stem + '.json'
+            profile.write(path_stem)
+    else:
+        template_nb_path = template_paths[0]
+        users_df['notebook_urls'] = [get_github_user_notebook_url(u, template_nb_path, repo_name, args.raw_github_url)
+                                     for u in users_df['gh_username']]
+        nbe = NotebookExtractor(users_df, template_nb_path, include_usernames=args.include_usernames,
+                                shard_by=args.shard_by, output_filter=output_filter,
+                                cache=cache, engine=engine, state_dir=args.state_dir, rebuild_state=args.full,
+                                jobs=args.jobs, profile=profile, profile_matching=args.profile_matching,
+                                align=args.align, status_dir=args.status_dir, mirrors=mirrors)
+        nbe.extract()
+        if cache is not None:
+            cache.save()  # records the matches of the notebooks still being matched when the fetch ended
+        nbe.write_outputs(args.profile)
@@ -0,0 +1,131 @@
+""" A resident extraction service, which updates the outputs as students push.
+
+    A one-off run of `extract_answers_template.py` imports its dependencies,
+    parses its templates, fetches every notebook and writes its outputs from
+    scratch.  An `ExtractionDaemon` does that once, then keeps the extractors,
+    with their prompts, matchers, roster and every student's extracted
+    responses, in memory, and listens on a local HTTP port.  A POST names the
+    students whose repositories changed, either as a GitHub push webhook
+    payload or as {"gh_usernames": [...]}, and only their notebooks are fetched
+    and matched again before the outputs are rewritten.
+
+    The notebooks are read from git mirrors, which a push is visible in as soon
+    as it is made; raw.githubusercontent.com can serve the files as they were
+    before it for minutes after.
+
+        python scripts/extract_answers_template.py --git-mirrors mirrors --serve 8080 users.csv chap01ex.ipynb
+        curl -d '{"gh_usernames": ["janedoe"]}' http://127.0.0.1:8080/push
+"""
+
+import json
+import time
+import BaseHTTPServer
+
+
+def pushed_usernames(payload, repo_name):
+    """ Returns the usernames a POSTed `payload` names: the owner of the repository of a
+        GitHub push event, if the repository is `repo_name`, or the list `gh_usernames`.
+        Raises ValueError if `gh_usernames` is not a list of strings. """
+    if 'gh_usernames' in payload:
+        gh_usernames = payload['gh_usernames']
+        if not isinstance(gh_usernames, list) or not all(isinstance(u, basestring) for u in gh_usernames):
+            raise ValueError('gh_usernames must be a list of strings')
+        return gh_usernames
+    repository = payload.get('repository') or {}
+    owner = repository.get('owner') or {}
+    gh_username = owner.get('login') or owner.get('name')
+    if gh_username is None or repository.get('name') != repo_name:
+        return []
+    return [gh_username]
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        try:
+            payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        except ValueError as ex:
+            self.reply(400, {'error': str(ex)})
+            return
+        if not isinstance(payload, dict):
+            self.reply(400, {'error': 'expected a JSON object'})
+            return
+        daemon = self.server.daemon
+        try:
+            gh_usernames = pushed_usernames(payload, daemon.repo_name)
+        except ValueError as ex:
+            self.reply(400, {'error': str(ex)})
+            return
+        self.reply(200, daemon.update(gh_usernames))
+
+    def do_GET(self):
+        self.reply(200, self.server.daemon.status())
+
+    def reply(self, status, result):
+        body = json.dumps(result)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ExtractionDaemon(object):
+    """ Keeps the `NotebookExtractor`s `extractors`, for the templates of repository
+        `repo_name`, extracted and their outputs written.  With `write_profiles`,
+        each extractor's profile is written with its outputs. """
+
+    def __init__(self, extractors, repo_name, write_profiles=False):
+        self.extractors = extractors
+        self.repo_name = repo_name
+        self.write_profiles = write_profiles
+        self.updates = 0
+        self.last_update = None  # {gh_usernames, seconds} of the last update
+
+    def extract_all(self):
+        """Extracts every student's notebooks, and writes the outputs."""
+        for nbe in self.extractors:
+            nbe.extract()
+            nbe.write_outputs(self.write_profiles)
+        self.save_cache()
+
+    def update(self, gh_usernames):
+        """ Extracts the notebooks of those of `gh_usernames` on the roster again, and rewrites
+            the outputs.  Returns {gh_usernames, seconds} of what was updated. """
+        start = time.time()
+        gh_usernames = sorted(set(u for nbe in self.extractors for u in gh_usernames if u in nbe.roster.fullnames))
+        if gh_usernames:
+            for mirrors in set(nbe.mirrors for nbe in self.extractors if nbe.mirrors is not None):
+                mirrors.forget(gh_usernames, self.repo_name)
+            for nbe in self.extractors:
+                nbe.update(gh_usernames)
+                nbe.write_outputs(self.write_profiles)
+            self.save_cache()
+            self.updates += 1
+        self.last_update = {'gh_usernames': gh_usernames, 'seconds': time.time() - start}
+        print "Updated {} in {:.3f}s".format(', '.join(gh_usernames) or 'nobody', self.last_update['seconds'])
+        return self.last_update
+
+    def save_cache(self):
+        for cache in set(nbe.cache for nbe in self.extractors if nbe.cache is not None):
+            cache.save()
+
+    def status(self):
+        return {'templates': [nbe.nb_name_stem for nbe in self.extractors],
+                'students': len(set(u for nbe in self.extractors for u in nbe.usernames)),
+                'updates': self.updates, 'last_update': self.last_update}
+
+    def serve(self, port, host='127.0.0.1'):
+        """Handles update requests on `host`:`port`, one at a time, until interrupted."""
+        server = BaseHTTPServer.HTTPServer((host, port), _Handler)
+        server.daemon = self
+        print "Listening on http://{}:{}/".format(host, server.server_address[1])
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
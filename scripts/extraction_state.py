@@ -0,0 +1,57 @@
+""" Per-student extraction results kept between runs of a template.
+
+    For each student, the state records the content digest of the notebook that
+    was extracted and, for each prompt, the cells `QuestionPrompt.get_closest_match`
+    picked from it.  On a re-run, students whose notebook digest is unchanged are
+    served from the state without parsing or matching their notebook again.
+"""
+
+import cPickle as pickle
+import os
+
+from notebook_cache import write_atomically
+from notebook_stream import compact_cell
+
+
+class ExtractionState(object):
+    """ The saved results at `path` for the template identified by `fingerprint`.
+        Results saved for a different template fingerprint, or in another `FORMAT`,
+        are discarded, as are all saved results if `load` is false. """
+
+    FORMAT = 2  # of the saved cells; 2 has a `CompactCell`'s members as a tuple
+
+    def __init__(self, path, fingerprint, load=True):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.students = {}  # github username -> {digest, responses}
+        self.reused = 0
+        if load and os.path.exists(path):
+            try:
+                with open(path, 'rb') as fid:
+                    saved = pickle.load(fid)
+            except (IOError, EOFError, pickle.UnpicklingError):
+                saved = {}
+            if saved.get('fingerprint') == fingerprint and saved.get('format') == ExtractionState.FORMAT:
+                self.students = saved['students']
+
+    def get(self, gh_username, digest):
+        """Returns the saved responses of `gh_username` if they were extracted from notebook `digest`; else None."""
+        entry = self.students.get(gh_username)
+        if entry is None or entry['digest'] != digest:
+            return None
+        self.reused += 1
+        return entry['responses']
+
+    def put(self, gh_username, digest, responses):
+        self.students[gh_username] = {'digest': digest,
+                                      'responses': [map(compact_cell, cells) for cells in responses]}
+
+    def save(self, gh_usernames):
+        """Writes the state, keeping only the students in `gh_usernames`."""
+        gh_usernames = set(gh_usernames)
+        self.students = {u: entry for u, entry in self.students.items() if u in gh_usernames}
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        saved = {'fingerprint': self.fingerprint, 'format': ExtractionState.FORMAT, 'students': self.students}
+        write_atomically(self.path, pickle.dumps(saved, pickle.HIGHEST_PROTOCOL))
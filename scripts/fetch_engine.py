@@ -0,0 +1,177 @@
+""" A single-process HTTP fetcher with keep-alive connection pooling.
+
+    `FetchEngine.fetch` runs a fixed number of worker threads over a shared pool of
+    persistent connections, so a class's worth of notebooks costs one TCP+TLS
+    handshake per connection rather than one per URL.  Requests to a host are
+    limited to `per_host` at a time, transient failures (connection errors, 429
+    and 5xx) are retried with exponential backoff, and responses are yielded in
+    completion order so callers can parse each one while the rest are in flight.
+"""
+
+import httplib
+import socket
+import sys
+import threading
+import time
+import urlparse
+from Queue import Queue
+
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+REDIRECT_STATUSES = frozenset([301, 302, 303, 307, 308])
+MAX_REDIRECTS = 5
+
+
+class Response(object):
+    """ The outcome of fetching `url`.  `status` is None if the request failed
+        after all retries; `headers` has lower-case names. """
+
+    def __init__(self, url, status=None, headers=None, body=None, elapsed=0.0):
+        self.url = url
+        self.status = status
+        self.headers = headers or {}
+        self.body = body
+        self.elapsed = elapsed
+
+    @property
+    def ok(self):
+        return self.status is not None and 200 <= self.status <= 299
+
+
+def print_progress(done, total):
+    """The default progress reporter: a single, rewritten line on stderr."""
+    sys.stderr.write("\r{}/{} fetched".format(done, total))
+    if done == total:
+        sys.stderr.write("\n")
+    sys.stderr.flush()
+
+
+class FetchEngine(object):
+    """ Fetches URLs with up to `concurrency` requests in flight, at most `per_host` to any one host.
+        `on_response`, if given, is called with each `Response` as it completes. """
+
+    def __init__(self, concurrency=20, per_host=10, timeout=30, retries=3, backoff=0.5, progress=print_progress,
+                 on_response=None):
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.progress = progress
+        self.on_response = on_response
+        self._lock = threading.Lock()
+        self._idle = {}  # (scheme, netloc) -> [connection]
+        self._host_slots = {}  # (scheme, netloc) -> BoundedSemaphore
+
+    def fetch(self, requests):
+        """ Given an iterable of `(url, headers)`, yields a `Response` for each as it completes. """
+        requests = list(requests)
+        if not requests:
+            return
+        pending, done = Queue(), Queue()
+        for request in requests:
+            pending.put(request)
+        workers = min(self.concurrency, len(requests))
+        for _ in range(workers):
+            pending.put(None)
+            worker = threading.Thread(target=self._work, args=(pending, done))
+            worker.daemon = True
+            worker.start()
+        for count in range(1, len(requests) + 1):
+            response = done.get()
+            if self.progress:
+                self.progress(count, len(requests))
+            if self.on_response:
+                self.on_response(response)
+            yield response
+
+    def fetch_all(self, requests):
+        """Returns a dictionary {url -> `Response`}."""
+        return {response.url: response for response in self.fetch(requests)}
+
+    def close(self):
+        with self._lock:
+            for connections in self._idle.values():
+                for connection in connections:
+                    connection.close()
+            self._idle.clear()
+
+    def _work(self, pending, done):
+        while True:
+            request = pending.get()
+            if request is None:
+                return
+            url, headers = request
+            start = time.time()
+            try:
+                response = self._get(url, headers)
+            except Exception as ex:
+                print >> sys.stderr, "error fetching {}: {}".format(url, ex)
+                response = Response(url)
+            response.elapsed = time.time() - start
+            done.put(response)
+
+    def _get(self, url, headers):
+        """Fetches `url`, following redirects and retrying transient failures."""
+        target = url
+        for _ in range(MAX_REDIRECTS + 1):
+            status, response_headers, body = self._get_with_retries(target, headers)
+            if status not in REDIRECT_STATUSES or 'location' not in response_headers:
+                return Response(url, status, response_headers, body)
+            target = urlparse.urljoin(target, response_headers['location'])
+        raise IOError("too many redirects")
+
+    def _get_with_retries(self, url, headers):
+        for attempt in range(self.retries + 1):
+            last_attempt = attempt == self.retries
+            try:
+                status, response_headers, body = self._request(url, headers)
+            except (socket.error, httplib.HTTPException):
+                if last_attempt:
+                    raise
+                time.sleep(self.backoff * 2 ** attempt)
+                continue
+            if status not in RETRY_STATUSES or last_attempt:
+                return status, response_headers, body
+            retry_after = response_headers.get('retry-after', '')
+            time.sleep(float(retry_after) if retry_after.isdigit() else self.backoff * 2 ** attempt)
+
+    def _request(self, url, headers):
+        parts = urlparse.urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        with self._slot(key):
+            connection = self._checkout(key)
+            try:
+                connection.request('GET', path, headers=headers)
+                response = connection.getresponse()
+                body = response.read()
+            except Exception:
+                connection.close()
+                raise
+            response_headers = dict(response.getheaders())
+            if response_headers.get('connection', '').lower() == 'close':
+                connection.close()
+            else:
+                self._checkin(key, connection)
+            return response.status, response_headers, body
+
+    def _slot(self, key):
+        with self._lock:
+            if key not in self._host_slots:
+                self._host_slots[key] = threading.BoundedSemaphore(self.per_host)
+            return self._host_slots[key]
+
+    def _checkout(self, key):
+        with self._lock:
+            connections = self._idle.get(key)
+            if connections:
+                return connections.pop()
+        scheme, netloc = key
+        connection_class = httplib.HTTPSConnection if scheme == 'https' else httplib.HTTPConnection
+        return connection_class(netloc, timeout=self.timeout)
+
+    def _checkin(self, key, connection):
+        with self._lock:
+            self._idle.setdefault(key, []).append(connection)
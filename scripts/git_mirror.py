@@ -0,0 +1,146 @@
+""" Students' notebooks read from local mirrors of their repositories.
+
+    Instead of one request per notebook to raw.githubusercontent.com, a
+    `GitMirrors` keeps a bare mirror of each student's repository, cloned once
+    and brought up to date with an incremental `git fetch`.  A repository that
+    can be mirrored validates its owner's username, and notebooks are read
+    straight from the object store, with their blob hashes as digests: a notebook
+    whose blob is unchanged is known to be unchanged without reading it.
+
+    With a `deadline`, notebooks are read as of the last commit on the branch
+    made before it (by committer date), so late work is left out.
+
+    Any URL git can clone from will do as `clone_url`, including file:// ones.
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+from multiprocessing.pool import ThreadPool
+
+# never ask for credentials: GitHub answers a clone of a missing repository with a login prompt
+_GIT_ENV = dict(os.environ, GIT_TERMINAL_PROMPT='0', GIT_ASKPASS='true')
+
+
+class GitError(Exception):
+    pass
+
+
+def _git(git_dir, *args):
+    """Returns the output of git command `args` on the repository `git_dir`; raises `GitError` if it fails."""
+    command = ['git'] + (['--git-dir', git_dir] if git_dir is not None else []) + list(args)
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=_GIT_ENV)
+    out, err = process.communicate()
+    if process.returncode:
+        raise GitError('{}: {}'.format(' '.join(command), err.strip()))
+    return out
+
+
+class GitMirrors(object):
+    """ Bare mirrors in `directory` of the repositories `clone_url`<username>/<repo>,
+        updated `jobs` at a time.  Notebooks are named by their URLs under `raw_github_url`,
+        <raw_github_url><username>/<repo>/<branch>/<path>, as `get_github_user_notebook_url`
+        makes them.  They are read as of `deadline` (anything `git rev-list --before`
+        accepts, e.g. '2016-02-01 17:00') if given. """
+
+    def __init__(self, directory, clone_url, raw_github_url, deadline=None, jobs=8):
+        self.directory = directory
+        self.clone_url = clone_url
+        self.raw_github_url = raw_github_url
+        self.deadline = deadline
+        self.jobs = jobs
+        self.available = {}  # (username, repo) -> whether it could be mirrored, for those updated in this run
+        self.commits = {}  # (username, repo, branch) -> the commit notebooks are read from, or None
+
+    def mirror_path(self, gh_username, repo_name):
+        return os.path.join(self.directory, gh_username, repo_name + '.git')
+
+    def update(self, gh_usernames, repo_name):
+        """ Clones or fetches each user's repository `repo_name`, unless done already in this run.
+            Returns {username -> whether their repository is mirrored}. """
+        pending = [u for u in set(gh_usernames) if (u, repo_name) not in self.available]
+        if pending:
+            pool = ThreadPool(min(self.jobs, len(pending)))
+            for gh_username, available in zip(pending, pool.map(lambda u: self._update(u, repo_name), pending)):
+                self.available[gh_username, repo_name] = available
+            pool.close()
+        return {u: self.available[u, repo_name] for u in gh_usernames}
+
+    def forget(self, gh_usernames, repo_name):
+        """Makes the next `update` of the users' repository `repo_name` fetch it again."""
+        gh_usernames = set(gh_usernames)
+        for gh_username in gh_usernames:
+            self.available.pop((gh_username, repo_name), None)
+        self.commits = {key: commit for key, commit in self.commits.items()
+                        if key[0] not in gh_usernames or key[1] != repo_name}
+
+    def _update(self, gh_username, repo_name):
+        path = self.mirror_path(gh_username, repo_name)
+        if os.path.isdir(path):
+            try:
+                _git(path, 'fetch', '--prune', '--quiet', 'origin')
+            except GitError as ex:
+                # the mirror is still what was there at the last fetch
+                print >> sys.stderr, "error updating {}: {}".format(path, ex)
+            return True
+        url = '{}{}/{}'.format(self.clone_url, gh_username, repo_name)
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        try:
+            _git(None, 'clone', '--mirror', '--quiet', url, tmp_path)
+        except GitError:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            user_dir = os.path.dirname(path)
+            if os.path.isdir(user_dir) and not os.listdir(user_dir):
+                os.rmdir(user_dir)
+            return False
+        os.rename(tmp_path, path)
+        return True
+
+    def commit(self, gh_username, repo_name, branch):
+        """Returns the commit of `branch` that notebooks are read from, or None if there is none."""
+        key = gh_username, repo_name, branch
+        if key not in self.commits:
+            path = self.mirror_path(gh_username, repo_name)
+            try:
+                if self.deadline is None:
+                    commit = _git(path, 'rev-parse', '--verify', '--quiet', branch + '^{commit}').strip()
+                else:
+                    commit = _git(path, 'rev-list', '-1', '--before=' + self.deadline, branch).strip()
+            except GitError:
+                commit = ''
+            self.commits[key] = commit or None
+        return self.commits[key]
+
+    def read(self, gh_username, repo_name, branch, path):
+        """ Returns (blob hash, contents) of the file at `path` on `branch` of the user's repository,
+            as of the deadline; or None if it isn't there. """
+        commit = self.commit(gh_username, repo_name, branch)
+        if commit is None:
+            return None
+        git_dir = self.mirror_path(gh_username, repo_name)
+        try:
+            blob = _git(git_dir, 'rev-parse', '--verify', '--quiet', '{}:{}'.format(commit, path)).strip()
+            return blob, _git(git_dir, 'cat-file', 'blob', blob)  # fails if `path` is a directory
+        except GitError:
+            return None
+
+    def fetch_notebooks(self, urls):
+        """ Yields (url, body, digest) for each of `urls`, like `fetch_notebook_responses` without
+            a cache, but with the blob hash as `digest`. """
+        prefix = self.raw_github_url
+        locations = [url[len(prefix):].split('/', 3) if url.startswith(prefix) else None for url in urls]
+        repos = {}
+        for location in locations:
+            if location is not None and len(location) == 4:
+                repos.setdefault(location[1], set()).add(location[0])
+        for repo_name, gh_usernames in repos.items():
+            self.update(gh_usernames, repo_name)
+        for url, location in zip(urls, locations):
+            found = None
+            if location is not None and len(location) == 4 and self.available.get((location[0], location[1])):
+                found = self.read(*location)
+            if found is None:
+                yield url, None, None
+            else:
+                yield url, found[1], found[0]
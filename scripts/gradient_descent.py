@@ -0,0 +1,176 @@
+""" Least squares by gradient descent, from "Machine Learning from the Ground Up".
+
+    The notebook (testing_notebooks/Bottom up implementation of machine
+    learning-Copy1.ipynb) builds these one piece at a time, with a Python loop
+    over the samples in each.  The loop versions are kept here, with `_loop` in
+    their names, as the reference the course starts from; the versions without
+    it compute the same with NumPy array operations.
+
+    `gradient_descent` and `gradient_descent_multi` take full steps with the
+    notebook's adaptive step size.  `minibatch_gradient_descent` instead steps
+    on one chunk of the data at a time, from any source of chunks, such as
+    `csv_batches`, which reads a CSV file a chunk at a time; with chunks of one
+    sample it is stochastic gradient descent.
+
+    Weights `w` are 1-D arrays of length d, samples `X` are n x d arrays and
+    targets `y` 1-D arrays of length n.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def error_loop(w, x, y):
+    """The sum of squared residuals of the slope `w` on the samples `x`, `y`."""
+    return np.sum([(y[i] - w * x[i]) ** 2 for i in range(len(x))])
+
+
+def error(w, x, y):
+    """The sum of squared residuals of the slope `w` on the samples `x`, `y`."""
+    residuals = y - w * x
+    return residuals.dot(residuals)
+
+
+def error_grad_loop(w, x, y):
+    """The derivative of `error` with respect to `w`."""
+    return np.sum([2 * (y[i] - w * x[i]) * (-x[i]) for i in range(len(x))])
+
+
+def error_grad(w, x, y):
+    """The derivative of `error` with respect to `w`."""
+    return -2 * (y - w * x).dot(x)
+
+
+def gradient_descent(w, x, y, alpha, iters, grow=1.5, shrink=0.6):
+    """ Fits the slope of `y` on `x` in `iters` steps from `w`, starting with step size `alpha`.
+        A step that lowers the error is taken, and the step size multiplied by `grow`;
+        otherwise the step size is multiplied by `shrink`.
+        Returns the slope and an array of the error after each step. """
+    errors = np.zeros(iters)
+    last_error = error(w, x, y)
+    for i in range(iters):
+        w_proposed = w - alpha * error_grad(w, x, y)
+        error_proposed = error(w_proposed, x, y)
+        if error_proposed < last_error:
+            last_error = error_proposed
+            w = w_proposed
+            alpha *= grow
+        else:
+            alpha *= shrink
+        errors[i] = last_error
+    return w, errors
+
+
+def error_multi(w, X, y):
+    """The sum of squared residuals of the weights `w` on the samples `X`, `y`."""
+    residuals = X.dot(w) - y
+    return residuals.dot(residuals)
+
+
+def partial_error_multi_loop(w, X, y, j):
+    """The partial derivative of `error_multi` with respect to `w[j]`."""
+    partial = 0
+    for i in range(X.shape[0]):
+        prediction = X[i, :].dot(w)
+        partial += 2 * (prediction - y[i]) * X[i, j]
+    return partial
+
+
+def partial_error_multi(w, X, y, j):
+    """The partial derivative of `error_multi` with respect to `w[j]`."""
+    return 2 * (X.dot(w) - y).dot(X[:, j])
+
+
+def grad_error_multi_loop(w, X, y):
+    """The gradient of `error_multi` with respect to `w`."""
+    grad = np.zeros(w.shape)
+    residuals = X.dot(w) - y
+    for i in range(X.shape[0]):
+        grad += 2 * residuals[i] * X[i, :]
+    return grad
+
+
+def grad_error_multi(w, X, y):
+    """The gradient of `error_multi` with respect to `w`."""
+    return 2 * X.T.dot(X.dot(w) - y)
+
+
+def gradient_descent_multi(w, X, y, alpha, iters, grow=1.1, shrink=0.2, grad=grad_error_multi):
+    """ Fits the weights of `y` on `X` as `gradient_descent` does the slope; `grad`
+        computes the gradient.  Returns the weights and an array of the error after each step. """
+    errors = np.zeros(iters)
+    last_error = error_multi(w, X, y)
+    for i in range(iters):
+        w_proposed = w - alpha * grad(w, X, y)
+        error_proposed = error_multi(w_proposed, X, y)
+        if error_proposed < last_error:
+            last_error = error_proposed
+            w = w_proposed
+            alpha *= grow
+        else:
+            alpha *= shrink
+        errors[i] = last_error
+    return w, errors
+
+
+def array_batches(X, y, batch_size, seed=0):
+    """ Returns a function yielding, each time it is called, (X, y) chunks of `batch_size`
+        samples of `X`, `y`, covering them once in a new random order. """
+    rng = np.random.RandomState(seed)
+
+    def batches():
+        order = rng.permutation(len(y))
+        for start in range(0, len(y), batch_size):
+            chunk = order[start:start + batch_size]
+            yield X[chunk], y[chunk]
+    return batches
+
+
+def csv_batches(path, prepare, chunksize):
+    """ Returns a function yielding, each time it is called, the (X, y) that `prepare`
+        makes of each chunk of `chunksize` rows of the CSV file `path`, a `DataFrame`.
+        The file is read a chunk at a time, so it needn't fit in memory. """
+    def batches():
+        for chunk in pd.read_csv(path, chunksize=chunksize):
+            yield prepare(chunk)
+    return batches
+
+
+def minibatch_gradient_descent(w, batches, alpha, epochs, decay=0.0):
+    """ Fits the weights `w` by a step on each chunk of samples in turn.
+
+        `batches()` is called once per epoch, and yields (X, y) chunks; see `array_batches`
+        and `csv_batches`.  Each step follows the gradient of the chunk's mean squared
+        residual, so `alpha` does not depend on the chunk size; the step size of the t-th
+        step is alpha / (1 + decay * t).  Returns the weights and an array of the mean
+        squared residual over each epoch's chunks, as they were stepped on. """
+    errors = np.zeros(epochs)
+    step = 0
+    for epoch in range(epochs):
+        total, count = 0.0, 0
+        for X, y in batches():
+            residuals = X.dot(w) - y
+            total += residuals.dot(residuals)
+            count += len(y)
+            w = w - alpha / (1 + decay * step) * 2 * X.T.dot(residuals) / len(y)
+            step += 1
+        errors[epoch] = total / max(count, 1)
+    return w, errors
+
+
+def stochastic_gradient_descent(w, X, y, alpha, epochs, decay=0.0, seed=0):
+    """`minibatch_gradient_descent` on one sample of `X`, `y` at a time, in a random order each epoch."""
+    return minibatch_gradient_descent(w, array_batches(X, y, 1, seed), alpha, epochs, decay)
+
+
+TITANIC_FEATURES = ['intercept', 'Pclass', 'female', 'Age (decades)', 'SibSp', 'Parch', 'Fare (100s)']
+
+
+def titanic_features(df, age_fill=28.0):
+    """ Returns the samples (X, y) of a Titanic passenger `DataFrame`, with the columns
+        `TITANIC_FEATURES`, and `Survived` as the target, or None if it has none.
+        Missing ages are taken as `age_fill`, the median in titanic_train.csv. """
+    X = np.column_stack([np.ones(len(df)), df['Pclass'], df['Sex'] == 'female', df['Age'].fillna(age_fill) / 10.0,
+                         df['SibSp'], df['Parch'], df['Fare'].fillna(0) / 100.0]).astype(float)
+    y = df['Survived'].values.astype(float) if 'Survived' in df else None
+    return X, y
@@ -0,0 +1,98 @@
+""" Global alignment of a template's cells with a student notebook's cells.
+
+    `align` pairs template cells with notebook cells in order, the way a diff
+    would.  Cells whose text is unique in both notebooks and equal are anchors;
+    the longest run of anchors that is in the same order in both (found by
+    patience sorting) is fixed first.  Only the gaps between consecutive anchors
+    are then aligned fuzzily, by an LCS-style dynamic program over the pairs within
+    the edit distance threshold.  Unique equal cells that are out of that order,
+    as when a student moves an exercise, are aligned with each other all the same,
+    and left out of the gaps.  Since students mostly leave the template's cells
+    alone, the gaps are short, and the whole alignment is about linear in the
+    number of cells.
+"""
+
+from bisect import bisect_left
+from collections import Counter
+
+from edit_distance import distance_matrix
+
+
+def _anchors(a, b):
+    """ Returns [(i, j)] of the strings unique to both `a` and `b`, with a[i] == b[j]:
+        the longest subsequence that is increasing in both i and j, and the rest. """
+    a_counts, b_counts = Counter(a), Counter(b)
+    b_index = {s: j for j, s in enumerate(b) if b_counts[s] == 1}
+    pairs = [(i, b_index[s]) for i, s in enumerate(a) if a_counts[s] == 1 and s in b_index]
+
+    # patience sorting: the longest increasing subsequence of j, with back pointers
+    tails, tail_pairs, previous = [], [], {}
+    for i, j in pairs:
+        k = bisect_left(tails, j)
+        previous[(i, j)] = tail_pairs[k - 1] if k else None
+        if k == len(tails):
+            tails.append(j)
+            tail_pairs.append((i, j))
+        else:
+            tails[k] = j
+            tail_pairs[k] = (i, j)
+    anchors = []
+    pair = tail_pairs[-1] if tail_pairs else None
+    while pair is not None:
+        anchors.append(pair)
+        pair = previous[pair]
+    anchors.reverse()
+    in_order = set(anchors)
+    return anchors, [pair for pair in pairs if pair not in in_order]
+
+
+def _align_gap(a, b, a_indices, b_indices, threshold):
+    """ Returns [(i, j, distance)] of the most pairs of `a` and `b`, in order, within
+        `threshold` of each other (fewest total edits among those), where i and j are
+        the pairs' indices in `a_indices` and `b_indices`. """
+    distances = distance_matrix(a, b, threshold)
+    # best[i][j]: (pairs, -edits) of the best alignment of a[i:] and b[j:]
+    best = [[(0, 0)] * (len(b) + 1) for _ in range(len(a) + 1)]
+    for i in range(len(a) - 1, -1, -1):
+        for j in range(len(b) - 1, -1, -1):
+            options = [best[i + 1][j], best[i][j + 1]]
+            if distances[i, j] <= threshold:
+                pairs, edits = best[i + 1][j + 1]
+                options.append((pairs + 1, edits - int(distances[i, j])))
+            best[i][j] = max(options)
+    aligned = []
+    i = j = 0
+    while i < len(a) and j < len(b):
+        if distances[i, j] <= threshold:
+            pairs, edits = best[i + 1][j + 1]
+            if best[i][j] == (pairs + 1, edits - int(distances[i, j])):
+                aligned.append((a_indices[i], b_indices[j], int(distances[i, j])))
+                i += 1
+                j += 1
+                continue
+        if best[i][j] == best[i + 1][j]:
+            i += 1
+        else:
+            j += 1
+    return aligned
+
+
+def align(a, b, threshold):
+    """ Aligns the strings `a` (the template's cells) with `b` (a notebook's).
+        Returns [(i, j, distance)] for each pair of a[i] and b[j] aligned, sorted by i,
+        and the number of pairs whose edit distance was computed.
+        Aligned pairs are never more than `threshold` edits apart. """
+    anchors, moved = _anchors(a, b)
+    aligned = [(i, j, 0) for i, j in anchors + moved]
+    moved_a, moved_b = set(i for i, _ in moved), set(j for _, j in moved)
+    computed = 0
+    previous_i = previous_j = -1
+    for i, j in anchors + [(len(a), len(b))]:
+        gap_a = [k for k in range(previous_i + 1, i) if k not in moved_a]
+        gap_b = [k for k in range(previous_j + 1, j) if k not in moved_b]
+        if gap_a and gap_b:
+            aligned.extend(_align_gap([a[k] for k in gap_a], [b[k] for k in gap_b], gap_a, gap_b, threshold))
+            computed += len(gap_a) * len(gap_b)
+        previous_i, previous_j = i, j
+    aligned.sort()
+    return aligned, computed
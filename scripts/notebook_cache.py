@@ -0,0 +1,201 @@
+""" A content-addressed on-disk cache of fetched URLs.
+
+    Each URL maps to the status, ETag and Last-Modified of its last response and
+    to the SHA-1 of its body.  Bodies are stored once per digest under `objects/`,
+    so identical notebooks share storage, and anything derived from a body (the
+    parsed notebook, its prompt matches) is stored beside it under `derived/`,
+    keyed by the digest and a `kind` string.  Entries are revalidated with
+    conditional requests, and the least recently used ones are evicted once the
+    cache grows past `max_bytes`, when it is saved at the end of a run: nothing a
+    run has fetched is evicted while the run may still read it.
+"""
+
+import cPickle as pickle
+import errno
+import hashlib
+import json
+import os
+import time
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+def write_atomically(path, data):
+    """ Writes the bytes `data` to `path` through a temporary file renamed over it, so
+        that a reader, or a run that is interrupted, never sees a partly written file. """
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'wb') as fid:
+        fid.write(data)
+    os.rename(tmp_path, path)
+
+
+class NotebookCache(object):
+    """ An on-disk cache of URL responses, in `directory`.
+        With `offline`, no requests are made and only cached responses are served. """
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES, offline=False):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.index_path = os.path.join(directory, 'index.json')
+        for subdir in ('objects', 'derived'):
+            path = os.path.join(directory, subdir)
+            if not os.path.isdir(path):
+                os.makedirs(path)
+        self.urls = {}  # url -> {status, etag, last_modified, digest, used}
+        self.objects = {}  # digest -> {size, derived: {kind -> size}}
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as fid:
+                index = json.load(fid)
+            self.urls, self.objects = index['urls'], index['objects']
+        self.hits = self.misses = 0
+        self.derived_records = []  # (digest, kind, size) stored by this instance
+
+    def fetch(self, urls, engine, keep_body=True):
+        """ Yields `(url, status, digest)` for each of `urls` as it becomes available:
+            revalidating cached URLs and fetching the rest with the `FetchEngine`.
+            The body of a 2xx response can be read with `read(digest)`; without
+            `keep_body` only the status is kept.  Writes the index when done, but
+            evicts nothing; that is left to `save`. """
+        urls = list(urls)
+        if self.offline:
+            for url in urls:
+                yield self._result(url)
+        else:
+            requests = [(url, self.conditional_headers(url)) for url in urls]
+            for response in engine.fetch(requests):
+                self.update(response.url, response.status, response.headers, response.body, keep_body)
+                yield self._result(response.url)
+        self.write_index()
+
+    def fetch_all(self, urls, engine, keep_body=True):
+        """Returns a dictionary {url -> (status, digest)}; see `fetch`."""
+        return {url: (status, digest) for url, status, digest in self.fetch(urls, engine, keep_body)}
+
+    def conditional_headers(self, url):
+        """Returns the request headers that revalidate the cached response for `url`."""
+        entry = self.urls.get(url, {})
+        headers = {}
+        if entry.get('digest') is not None and not self.has_body(entry['digest']):
+            return headers  # the body is gone, so it has to be fetched anew
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def _result(self, url):
+        entry = self.urls.get(url)
+        if entry is None:
+            return url, None, None
+        if entry.get('digest') is not None and not self.has_body(entry['digest']):
+            return url, None, None  # offline, with the body gone
+        entry['used'] = time.time()
+        return url, entry['status'], entry.get('digest')
+
+    def update(self, url, status, headers, body, keep_body=True):
+        """ Records the response to a (possibly conditional) request for `url`.
+            `headers` has lower-case names. """
+        if status is None:
+            return  # network failure; keep whatever we had
+        if status == 304 and url in self.urls:
+            self.hits += 1
+            return
+        self.misses += 1
+        entry = {'status': status, 'used': time.time()}
+        if 200 <= status <= 299:
+            entry['etag'] = headers.get('etag')
+            entry['last_modified'] = headers.get('last-modified')
+            if keep_body and body is not None:
+                entry['digest'] = self.store(body)
+        previous = self.urls.get(url, {})
+        self.urls[url] = entry
+        self._release(previous.get('digest'))
+
+    def store(self, body):
+        """Stores `body` under its content digest, and returns the digest."""
+        digest = hashlib.sha1(body).hexdigest()
+        if not self.has_body(digest):
+            write_atomically(self._object_path(digest), body)
+            self.objects.setdefault(digest, {'size': len(body), 'derived': {}})
+        return digest
+
+    def has_body(self, digest):
+        return digest in self.objects and os.path.exists(self._object_path(digest))
+
+    def read(self, digest):
+        """Returns the body stored under `digest`, or None if it is not there (a cache miss)."""
+        try:
+            with open(self._object_path(digest), 'rb') as fid:
+                return fid.read()
+        except IOError as ex:
+            if ex.errno != errno.ENOENT:
+                raise
+            return None
+
+    def load_derived(self, digest, kind):
+        """Returns the object stored by `store_derived(digest, kind, ...)`, or None."""
+        if kind not in self.objects.get(digest, {}).get('derived', {}):
+            return None
+        try:
+            with open(self._derived_path(digest, kind), 'rb') as fid:
+                return pickle.load(fid)
+        except Exception:
+            return None  # missing, corrupt, or pickled from classes this program no longer has
+
+    def store_derived(self, digest, kind, value):
+        if digest not in self.objects:
+            return
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        write_atomically(self._derived_path(digest, kind), data)
+        self.objects[digest]['derived'][kind] = len(data)
+        self.derived_records.append((digest, kind, len(data)))
+
+    def add_derived_records(self, records):
+        """ Records derived entries that another process (with a copy of this cache)
+            stored, as listed in its `derived_records`. """
+        for digest, kind, size in records:
+            if digest in self.objects:
+                self.objects[digest]['derived'][kind] = size
+
+    def save(self):
+        """ Evicts least recently used entries down to `max_bytes`, and writes the index.
+            Call it once the bodies fetched have all been read. """
+        self._evict()
+        self.write_index()
+
+    def write_index(self):
+        write_atomically(self.index_path, json.dumps({'urls': self.urls, 'objects': self.objects}))
+
+    def _size(self):
+        return sum(obj['size'] + sum(obj['derived'].values()) for obj in self.objects.values())
+
+    def _evict(self):
+        size = self._size()
+        by_age = sorted(self.urls.items(), key=lambda t: t[1]['used'])
+        while size > self.max_bytes and by_age:
+            url, entry = by_age.pop(0)
+            del self.urls[url]
+            size -= self._release(entry.get('digest'))
+
+    def _release(self, digest):
+        """Removes the object `digest` if no URL refers to it any more. Returns the bytes freed."""
+        if digest is None or digest not in self.objects \
+                or any(e.get('digest') == digest for e in self.urls.values()):
+            return 0
+        obj = self.objects.pop(digest)
+        self._remove(self._object_path(digest))
+        for kind in obj['derived']:
+            self._remove(self._derived_path(digest, kind))
+        return obj['size'] + sum(obj['derived'].values())
+
+    def _object_path(self, digest):
+        return os.path.join(self.directory, 'objects', digest)
+
+    def _derived_path(self, digest, kind):
+        return os.path.join(self.directory, 'derived', '{}.{}.pickle'.format(digest, kind))
+
+    @staticmethod
+    def _remove(path):
+        if os.path.exists(path):
+            os.remove(path)
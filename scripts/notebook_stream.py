@@ -0,0 +1,94 @@
+""" Compact cells, for keeping many students' answers until they are written.
+
+    A student notebook is mostly outputs: base64 PNGs and dataframe HTML.  The cells
+    of extracted answers are kept until the summary is written, so `compact_cell`
+    reduces each to a `CompactCell`: its source, with the lines shared between
+    students stored once, and the JSON text of each of its other members, which
+    `dump_cell` copies out as it is and only `load_cell` decodes.
+"""
+
+import json
+from json.decoder import scanstring
+
+EAGER_KEYS = frozenset([u'cell_type', u'source'])
+
+
+class CompactCell(object):
+    """ A cell as kept in an extracted answer: its `cell_type`, its `source` (a tuple of
+        lines, or a string), and `rest`, a tuple of the JSON texts `"key": value`
+        of its other members. """
+
+    __slots__ = ('cell_type', 'source', 'rest')
+
+    def __init__(self, cell_type, source, rest):
+        self.cell_type = cell_type
+        self.source = source
+        self.rest = rest
+
+    def __getitem__(self, key):
+        if key == u'cell_type':
+            return self.cell_type
+        if key == u'source':
+            return self.source
+        return self.load()[key]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def load(self):
+        """Returns the complete cell as a plain dict."""
+        cell = json.loads('{' + ', '.join(self.rest) + '}')
+        cell[u'cell_type'] = self.cell_type
+        cell[u'source'] = self.source if isinstance(self.source, basestring) else list(self.source)
+        return cell
+
+    def replace(self, values):
+        """ Returns a copy with the members in the dict `values` set to those values, in place
+            of any it had, and its other members copied without being decoded. """
+        values = {key: _member(key, value) for key, value in values.items()}
+        rest = []
+        for member in self.rest:
+            key = scanstring(member, 1)[0]  # only the key is decoded
+            rest.append(values.pop(key, member))
+        return CompactCell(self.cell_type, self.source, tuple(rest) + tuple(values[key] for key in sorted(values)))
+
+
+def _member(key, value):
+    return json.dumps(key) + ': ' + json.dumps(value)
+
+
+def compact_cell(cell, interned=None):
+    """ Returns `cell` as a `CompactCell`.  Source lines and member texts equal to ones
+        already in the dict `interned` are replaced by those, and the others added to it.
+        A `CompactCell` is returned as it is, unless there is an `interned` to share it with. """
+    if isinstance(cell, CompactCell):
+        if interned is None:
+            return cell
+        cell_type, source, members = cell.cell_type, cell.source, cell.rest
+    else:
+        interned = {} if interned is None else interned
+        cell_type, source = cell[u'cell_type'], cell.get(u'source', u'')
+        members = [_member(key, value) for key, value in cell.items() if key not in EAGER_KEYS]
+    if isinstance(source, basestring):
+        source = interned.setdefault(source, source)
+    else:
+        source = tuple(interned.setdefault(line, line) for line in source)
+    rest = tuple(interned.setdefault(member, member) for member in members)
+    return CompactCell(cell_type, source, interned.setdefault(rest, rest))
+
+
+def load_cell(cell):
+    """Returns `cell` as a plain dict."""
+    return cell.load() if isinstance(cell, CompactCell) else cell
+
+
+def dump_cell(cell):
+    """ Returns `cell` as JSON text.  The other members of a `CompactCell` are copied
+        as they are, without being decoded. """
+    if not isinstance(cell, CompactCell):
+        return json.dumps(cell)
+    members = [_member(u'cell_type', cell.cell_type), _member(u'source', cell.source)]
+    return '{' + ', '.join(members + list(cell.rest)) + '}'
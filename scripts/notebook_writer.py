@@ -0,0 +1,34 @@
+""" Writing notebooks one cell at a time.
+
+    `dump_notebook` writes a notebook's top-level fields from a template, and
+    then its cells as they are produced, so a summary of a whole class never has
+    to be held in memory as one document.
+"""
+
+import json
+import os
+
+from notebook_stream import dump_cell
+
+
+def dump_notebook(path, template, cells):
+    """ Writes a notebook to `path` with the top-level fields (metadata, nbformat, ...)
+        of the notebook `template`, and the cells yielded by the iterable `cells`.
+        Returns the number of cells written. """
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    count = 0
+    with open(path, 'wb') as fid:
+        fid.write('{')
+        for key, value in template.items():
+            if key != 'cells':
+                fid.write(json.dumps(key) + ': ' + json.dumps(value) + ', ')
+        fid.write('"cells": [')
+        for cell in cells:
+            if count:
+                fid.write(', ')
+            fid.write(dump_cell(cell))
+            count += 1
+        fid.write(']}')
+    return count
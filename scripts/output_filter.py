@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+""" Size controls for the outputs of cells in a summary notebook.
+
+    Student notebooks are mostly outputs, and a summary notebook inherits all of
+    them.  An `OutputFilter` can strip code cells' outputs entirely, cut long text
+    and HTML outputs down to `max_chars`, or move images out of the notebook into
+    a content-addressed directory, where a plot many students produced is stored
+    once, and which the notebook then refers to by relative path.
+
+    Run as a script, it applies the same controls to an existing notebook:
+
+        python scripts/output_filter.py --externalize-images chap07ex_responses_raw.ipynb out.ipynb
+"""
+
+import argparse
+import base64
+import hashlib
+import json
+import os
+
+from notebook_cache import write_atomically
+from notebook_stream import CompactCell, load_cell
+from notebook_writer import dump_notebook
+
+IMAGE_TYPES = {'image/png': 'png', 'image/jpeg': 'jpg', 'image/gif': 'gif'}
+
+
+def _text(value):
+    """Joins a multi-line string field, which nbformat allows to be a list of lines."""
+    return value if isinstance(value, basestring) else u''.join(value)
+
+
+class ImageStore(object):
+    """ Image files in `directory`, named by the SHA-1 of their contents. """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.stored = set()  # file names known to be in the directory
+        self.written = 0  # images written by this instance
+
+    def store(self, data, extension):
+        """Stores the image bytes `data` unless already present. Returns its path."""
+        name = '{}.{}'.format(hashlib.sha1(data).hexdigest(), extension)
+        path = os.path.join(self.directory, name)
+        if name not in self.stored:
+            if not os.path.exists(path):
+                if not os.path.isdir(self.directory):
+                    os.makedirs(self.directory)
+                write_atomically(path, data)
+                self.written += 1
+            self.stored.add(name)
+        return path
+
+
+class OutputFilter(object):
+    """ Rewrites cells' outputs: removing them all if `strip`; truncating text and HTML
+        longer than `max_chars`; and moving images into the `ImageStore` `images`. """
+
+    def __init__(self, strip=False, max_chars=None, images=None):
+        self.strip = strip
+        self.max_chars = max_chars
+        self.images = images
+
+    def apply(self, cell, notebook_dir):
+        """ Returns `cell` with its outputs rewritten, for a notebook written in `notebook_dir`.
+            Cells without outputs are returned as they are. """
+        if cell['cell_type'] != 'code':
+            return cell
+        if self.strip:
+            if isinstance(cell, CompactCell):
+                return cell.replace({u'outputs': [], u'execution_count': None})  # without decoding the outputs
+            return dict(cell, outputs=[], execution_count=None)
+        cell = load_cell(cell)
+        if not cell.get('outputs'):
+            return cell
+        return dict(cell, outputs=[self.filter_output(output, notebook_dir) for output in cell['outputs']])
+
+    def filter_output(self, output, notebook_dir):
+        output = dict(output)
+        if self.max_chars is not None and 'text' in output:
+            output['text'] = self.truncate(_text(output['text']))
+        if 'data' in output:
+            data = dict(output['data'])
+            if self.max_chars is not None:
+                if 'text/html' in data and len(_text(data['text/html'])) > self.max_chars:
+                    # cutting HTML would break its markup, so fall back to the plain text
+                    html = data.pop('text/html')
+                    data.setdefault('text/plain', html)
+                if 'text/plain' in data:
+                    data['text/plain'] = self.truncate(_text(data['text/plain']))
+            if self.images is not None:
+                # after the size limits, which are for the student's outputs, not the link
+                for mime_type, extension in IMAGE_TYPES.items():
+                    if mime_type in data:
+                        path = self.images.store(base64.b64decode(_text(data.pop(mime_type))), extension)
+                        link = os.path.relpath(path, notebook_dir).replace(os.sep, '/')
+                        data['text/html'] = u'<img src="{}">'.format(link)
+            output['data'] = data
+        return output
+
+    def truncate(self, text):
+        if len(text) <= self.max_chars:
+            return text
+        return text[:self.max_chars] + u'\n... [{} more characters]'.format(len(text) - self.max_chars)
+
+
+def add_output_arguments(parser):
+    """Adds the options of `OutputFilter` to an `argparse` parser."""
+    parser.add_argument('--strip-outputs', action='store_true', help="remove code cells' outputs from the summary")
+    parser.add_argument('--max-output-chars', type=int, metavar='N',
+                        help='truncate text outputs longer than N characters, and drop HTML ones for their text')
+    parser.add_argument('--externalize-images', action='store_true',
+                        help='store images once each in an images directory beside the summary, and link to them')
+
+
+def output_filter_from_args(args, notebook_dir):
+    """Returns the `OutputFilter` the options ask for, or None; images go in `notebook_dir`/images."""
+    if not (args.strip_outputs or args.max_output_chars is not None or args.externalize_images):
+        return None
+    images = ImageStore(os.path.join(notebook_dir, 'images')) if args.externalize_images else None
+    return OutputFilter(args.strip_outputs, args.max_output_chars, images)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Shrink a notebook's outputs.")
+    parser.add_argument('notebook', type=str)
+    parser.add_argument('output', type=str)
+    add_output_arguments(parser)
+    args = parser.parse_args()
+    notebook_dir = os.path.dirname(os.path.abspath(args.output))
+    output_filter = output_filter_from_args(args, notebook_dir)
+    with open(args.notebook) as fid:
+        nb = json.load(fid)
+    cells = nb['cells'] if output_filter is None else (output_filter.apply(c, notebook_dir) for c in nb['cells'])
+    dump_notebook(args.output, nb, cells)
+    print "Wrote {} ({} bytes, from {})".format(args.output, os.path.getsize(args.output),
+                                                os.path.getsize(args.notebook))
+    if output_filter is not None and output_filter.images is not None:
+        print "Stored {} images in {}".format(output_filter.images.written, output_filter.images.directory)
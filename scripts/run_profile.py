@@ -0,0 +1,133 @@
+""" Instrumentation of a run: where the time went, and how much work was done.
+
+    A `RunProfile` accumulates, for each named stage, the wall-clock and CPU time
+    spent in it and the memory high-water mark at its end, along with counters
+    (bytes downloaded, cells scanned, edit distances computed, ...) and the
+    latency of every request.  `write` saves it as JSON, with the stages also
+    as CSV, and `profile_calls` runs a piece of code under cProfile.
+"""
+
+import cProfile
+import csv
+import json
+import os
+import pstats
+import resource
+import sys
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+
+# ru_maxrss is in bytes on OS X and in kilobytes elsewhere
+_MAXRSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+
+
+def _cpu_time():
+    user, system = os.times()[:2]
+    return user + system
+
+
+def _max_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * _MAXRSS_UNIT / 2.0 ** 20
+
+
+class RunProfile(object):
+    """ Timings, counters and request latencies of a run, in this process. """
+
+    def __init__(self):
+        self.stages = OrderedDict()  # name -> {wall, cpu, max_rss_mb, entries}
+        self.counters = Counter()
+        self.requests = []  # (url, status, seconds, bytes)
+        self.call_profiles = {}  # name -> cProfile.Profile
+        self.start = time.time()
+
+    @contextmanager
+    def stage(self, name):
+        """Adds the time spent in the block to stage `name`; a stage may be entered many times."""
+        wall, cpu = time.time(), _cpu_time()
+        try:
+            yield
+        finally:
+            if name not in self.stages:
+                self.stages[name] = OrderedDict([('wall', 0.0), ('cpu', 0.0), ('max_rss_mb', 0.0), ('entries', 0)])
+            stage = self.stages[name]
+            stage['wall'] += time.time() - wall
+            stage['cpu'] += _cpu_time() - cpu
+            stage['max_rss_mb'] = _max_rss_mb()
+            stage['entries'] += 1
+
+    def iterate(self, name, iterable):
+        """Yields the items of `iterable`, counting the time spent waiting for each as stage `name`."""
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def record_response(self, response):
+        """Records a `fetch_engine.Response`; pass this as a `FetchEngine`'s `on_response`."""
+        size = len(response.body) if response.body is not None else 0
+        self.requests.append((response.url, response.status, response.elapsed, size))
+        self.counters['requests'] += 1
+        self.counters['bytes_downloaded'] += size
+        if not response.ok and response.status != 304:  # a 304 revalidated a cached response
+            self.counters['failed_requests'] += 1
+
+    @contextmanager
+    def profile_calls(self, name, enabled=True):
+        """Runs the block under the cProfile profile `name` (accumulating), if `enabled`."""
+        if not enabled:
+            yield
+            return
+        profiler = self.call_profiles.setdefault(name, cProfile.Profile())
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+
+    def summary(self):
+        """Returns the profile as a JSON-serializable dict."""
+        latencies = sorted(seconds for _, _, seconds, _ in self.requests)
+
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))] if latencies else None
+
+        return OrderedDict([
+            ('wall', time.time() - self.start),
+            ('max_rss_mb', _max_rss_mb()),
+            ('stages', self.stages),
+            ('counters', OrderedDict(sorted(self.counters.items()))),
+            ('latency', OrderedDict([('requests', len(latencies)),
+                                     ('mean', sum(latencies) / len(latencies) if latencies else None),
+                                     ('p50', percentile(0.5)), ('p90', percentile(0.9)),
+                                     ('p99', percentile(0.99)), ('max', latencies[-1] if latencies else None)])),
+            ('requests', [OrderedDict([('url', url), ('status', status), ('seconds', seconds), ('bytes', size)])
+                          for url, status, seconds, size in self.requests]),
+        ])
+
+    def write(self, path_stem):
+        """ Writes `path_stem`.json, the stages as `path_stem`.csv, and for each cProfile profile,
+            its statistics as `path_stem`-<name>.pstats and, sorted by cumulative time, .txt.
+            Returns the paths written. """
+        paths = [path_stem + '.json', path_stem + '.csv']
+        with open(paths[0], 'w') as fid:
+            json.dump(self.summary(), fid, indent=1)
+        with open(paths[1], 'wb') as fid:
+            writer = csv.writer(fid)
+            writer.writerow(['stage', 'wall', 'cpu', 'max_rss_mb', 'entries'])
+            for name, stage in self.stages.items():
+                writer.writerow([name, stage['wall'], stage['cpu'], stage['max_rss_mb'], stage['entries']])
+        for name, profiler in self.call_profiles.items():
+            stats_path = '{}-{}.pstats'.format(path_stem, name)
+            profiler.dump_stats(stats_path)
+            with open(stats_path[:-len('.pstats')] + '.txt', 'w') as fid:
+                pstats.Stats(stats_path, stream=fid).sort_stats('cumulative').print_stats(40)
+            paths.extend([stats_path, stats_path[:-len('.pstats')] + '.txt'])
+        return paths
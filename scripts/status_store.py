@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+""" The answer statuses of a whole term, stored by assignment as compact arrays.
+
+    For each assignment (template notebook), the store keeps one status code per
+    student and prompt (answered, blank, missed, or no notebook at all) as an
+    int8 array, with the roster and the prompt names, in `<assignment>.npz` in
+    its directory.  Each run of `extract_answers_template.py` replaces the file
+    of its assignment, so the store accumulates the term, and the queries below
+    answer from the arrays without reading any notebook.
+
+    Run as a script, it prints the answers to the queries:
+
+        python scripts/status_store.py completion
+        python scripts/status_store.py most-missed --top 10
+        python scripts/status_store.py student janedoe
+"""
+
+import argparse
+import io
+import os
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from notebook_cache import write_atomically
+
+STATUSES = ['no notebook', 'missed', 'blank', 'answered']
+NO_NOTEBOOK, MISSED, BLANK, ANSWERED = range(len(STATUSES))
+STATUS_CODES = {status: code for code, status in enumerate(STATUSES)}
+
+
+class AssignmentStatus(object):
+    """ The statuses of one assignment: `codes[s, p]` is the status code of student
+        `students[s]` for prompt `prompts[p]`; `required[p]` is false for optional
+        prompts and polls. """
+
+    def __init__(self, students, prompts, codes, required):
+        self.students = list(students)
+        self.prompts = list(prompts)
+        self.codes = np.asarray(codes, dtype=np.int8).reshape(len(self.students), len(self.prompts))
+        self.required = np.asarray(required, dtype=bool)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as saved:
+            return cls(saved['students'], saved['prompts'], saved['codes'], saved['required'])
+
+    def save(self, path):
+        buf = io.BytesIO()
+        np.savez_compressed(buf, students=np.array(self.students, dtype=unicode),
+                            prompts=np.array(self.prompts, dtype=unicode), codes=self.codes, required=self.required)
+        write_atomically(path, buf.getvalue())
+
+    def frame(self):
+        """Returns the statuses as a DataFrame of students by prompts, with categorical columns."""
+        categories = pd.Categorical.from_codes
+        return pd.DataFrame(OrderedDict((prompt, categories(self.codes[:, p], STATUSES))
+                                        for p, prompt in enumerate(self.prompts)), index=self.students)
+
+
+class StatusStore(object):
+    """ The `AssignmentStatus` of each assignment, in files in `directory`. """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.loaded = {}  # assignment -> (modification time, AssignmentStatus)
+
+    def path(self, assignment):
+        return os.path.join(self.directory, assignment + '.npz')
+
+    def assignments(self):
+        """Returns the names of the assignments in the store, sorted."""
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(name[:-len('.npz')] for name in os.listdir(self.directory)
+                      if name.endswith('.npz'))
+
+    def get(self, assignment):
+        """Returns the `AssignmentStatus` of `assignment`, read again only if its file changed."""
+        path = self.path(assignment)
+        mtime = os.path.getmtime(path)
+        if assignment not in self.loaded or self.loaded[assignment][0] != mtime:
+            self.loaded[assignment] = (mtime, AssignmentStatus.load(path))
+        return self.loaded[assignment][1]
+
+    def put(self, assignment, status):
+        """Saves `status`, an `AssignmentStatus`, replacing any earlier one of `assignment`."""
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        status.save(self.path(assignment))
+
+    def completion(self, include_optional=False):
+        """ Returns a DataFrame of students by assignments, of the fraction of the prompts
+            each student answered, and their fraction over all assignments as 'Total'.
+            Only required prompts count unless `include_optional`. """
+        answered, asked = {}, {}
+        for assignment in self.assignments():
+            status = self.get(assignment)
+            prompts = slice(None) if include_optional else status.required
+            codes = status.codes[:, prompts]
+            answered[assignment] = pd.Series((codes == ANSWERED).sum(axis=1), index=status.students)
+            asked[assignment] = pd.Series(codes.shape[1], index=status.students)
+        answered, asked = pd.DataFrame(answered), pd.DataFrame(asked)
+        rates = answered / asked
+        rates['Total'] = answered.sum(axis=1) / asked.sum(axis=1)
+        return rates.sort_values('Total')
+
+    def most_missed(self, top=None, include_optional=False):
+        """ Returns a DataFrame of the prompts with the most students who submitted the
+            notebook but missed the prompt or left it blank, the `top` ones if given. """
+        rows = []
+        for assignment in self.assignments():
+            status = self.get(assignment)
+            submitted = status.codes[(status.codes != NO_NOTEBOOK).any(axis=1)]
+            missed = (submitted == MISSED).sum(axis=0)
+            blank = (submitted == BLANK).sum(axis=0)
+            for p, prompt in enumerate(status.prompts):
+                if include_optional or status.required[p]:
+                    rows.append([assignment, prompt, missed[p], blank[p], len(submitted)])
+        df = pd.DataFrame(rows, columns=['Assignment', 'Prompt', 'Missed', 'Blank', 'Submitted'])
+        df['Unanswered'] = (df['Missed'] + df['Blank']) / df['Submitted'].clip(lower=1)
+        df = df.sort_values(['Unanswered', 'Assignment'], ascending=[False, True]).reset_index(drop=True)
+        return df if top is None else df.head(top)
+
+    def student(self, gh_username):
+        """Returns a DataFrame of `gh_username`'s status for every prompt of every assignment."""
+        rows = []
+        for assignment in self.assignments():
+            status = self.get(assignment)
+            if gh_username not in status.students:
+                continue
+            codes = status.codes[status.students.index(gh_username)]
+            rows.extend([assignment, prompt, STATUSES[code], required]
+                        for prompt, code, required in zip(status.prompts, codes, status.required))
+        return pd.DataFrame(rows, columns=['Assignment', 'Prompt', 'Status', 'Required'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Query the answer statuses of the term's assignments.")
+    parser.add_argument('--store', type=str,
+                        default=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                             '.answer_status'),
+                        help='directory of the status store')
+    parser.add_argument('--include-optional', action='store_true', help='count optional prompts and polls too')
+    queries = parser.add_subparsers(dest='query')
+    queries.add_parser('completion', help="each student's fraction of prompts answered, per assignment")
+    most_missed = queries.add_parser('most-missed', help='the prompts most often missed or left blank')
+    most_missed.add_argument('--top', type=int, default=20, help='number of prompts to list')
+    student = queries.add_parser('student', help="a student's status for every prompt")
+    student.add_argument('gh_username', type=str)
+    args = parser.parse_args()
+
+    store = StatusStore(args.store)
+    pd.set_option('display.width', 200)
+    if args.query == 'completion':
+        print store.completion(args.include_optional).to_string(float_format='{:.0%}'.format)
+    elif args.query == 'most-missed':
+        print store.most_missed(args.top, args.include_optional).to_string(formatters={'Unanswered': '{:.0%}'.format})
+    else:
+        print store.student(args.gh_username).to_string()
@@ -0,0 +1,159 @@
+""" Tests for `notebook_cache.NotebookCache`, against a local `StandIn` for GitHub.
+
+        python -m unittest discover -s tests
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'scripts'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'benchmarks'))
+
+from fetch_engine import FetchEngine
+from notebook_cache import NotebookCache
+from stand_in import serve
+
+NAMES = ['a.ipynb', 'b.ipynb', 'c.ipynb']
+
+
+class NotebookCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='notebook-cache-test-')
+        self.www = os.path.join(self.directory, 'www')
+        self.cache_dir = os.path.join(self.directory, 'cache')
+        os.mkdir(self.www)
+        for name in NAMES:
+            self.write(name, '{"cells": [], "name": "%s"}' % name)
+        self.server = serve(self.www)
+        self.engine = FetchEngine(progress=None, retries=0)
+        self.urls = [self.server.url + name for name in NAMES]
+
+    def tearDown(self):
+        self.engine.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.directory)
+
+    def write(self, name, body):
+        with open(os.path.join(self.www, name), 'wb') as fid:
+            fid.write(body)
+
+    def fetch(self, cache, urls=None):
+        """Returns {url -> (status, body)} from fetching `urls` (all of them by default) through `cache`."""
+        return {url: (status, cache.read(digest) if digest is not None else None)
+                for url, status, digest in cache.fetch(self.urls if urls is None else urls, self.engine)}
+
+    def test_unchanged_notebooks_are_revalidated(self):
+        first = self.fetch(NotebookCache(self.cache_dir))
+        self.assertEqual(self.server.counts, {'ok': 3, 'not_modified': 0})
+
+        cache = NotebookCache(self.cache_dir)
+        self.assertIn('If-None-Match', cache.conditional_headers(self.urls[0]))
+        self.assertEqual(self.fetch(cache), first)
+        self.assertEqual((cache.hits, cache.misses), (3, 0))
+        self.assertEqual(self.server.counts, {'ok': 3, 'not_modified': 3})
+
+    def test_changed_notebooks_are_fetched_again(self):
+        self.fetch(NotebookCache(self.cache_dir))
+        self.write('b.ipynb', '{"cells": [], "changed": true}')
+        cache = NotebookCache(self.cache_dir)
+        responses = self.fetch(cache)
+        self.assertEqual(responses[self.urls[1]], (200, '{"cells": [], "changed": true}'))
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+
+    def test_revalidation_by_last_modified(self):
+        cache = NotebookCache(self.cache_dir)
+        self.fetch(cache)
+        for entry in cache.urls.values():
+            entry['etag'] = None
+        self.assertEqual(cache.conditional_headers(self.urls[0]).keys(), ['If-Modified-Since'])
+        self.fetch(cache)
+        self.assertEqual(cache.hits, 3)
+
+    def test_offline_serves_only_cached_responses(self):
+        first = self.fetch(NotebookCache(self.cache_dir), self.urls[:2])
+        cache = NotebookCache(self.cache_dir, offline=True)
+        responses = self.fetch(cache)
+        self.assertEqual(responses, dict(first, **{self.urls[2]: (None, None)}))
+        self.assertEqual(self.server.counts['ok'], 2)
+
+    def test_missing_body_is_a_miss(self):
+        cache = NotebookCache(self.cache_dir)
+        self.fetch(cache)
+        digest = cache.urls[self.urls[0]]['digest']
+        os.remove(os.path.join(self.cache_dir, 'objects', digest))
+        self.assertIsNone(cache.read(digest))
+        self.assertEqual(NotebookCache(self.cache_dir, offline=True).fetch_all(self.urls[:1], None),
+                         {self.urls[0]: (None, None)})
+
+        cache = NotebookCache(self.cache_dir)
+        self.assertEqual(cache.conditional_headers(self.urls[0]), {})
+        self.assertEqual(self.fetch(cache)[self.urls[0]], (200, '{"cells": [], "name": "a.ipynb"}'))
+
+    def test_least_recently_used_are_evicted_on_save(self):
+        cache = NotebookCache(self.cache_dir, max_bytes=70)  # room for two of the bodies
+        for url in self.urls:
+            self.fetch(cache, [url])
+            time.sleep(0.01)
+        # nothing is evicted before `save`, so a run can still read all it fetched
+        self.assertEqual(sorted(cache.urls), self.urls)
+        self.assertTrue(all(cache.read(entry['digest']) is not None for entry in cache.urls.values()))
+        cache.save()
+        self.assertEqual(sorted(cache.urls), self.urls[1:])
+        self.assertEqual(len(os.listdir(os.path.join(self.cache_dir, 'objects'))), 2)
+
+        self.fetch(cache, self.urls[1:2])  # b is now the most recently used
+        self.fetch(cache, self.urls[:1])
+        cache.save()
+        self.assertEqual(sorted(cache.urls), [self.urls[0], self.urls[1]])
+
+    def test_evicting_a_body_removes_its_derived_entries(self):
+        cache = NotebookCache(self.cache_dir, max_bytes=70)
+        self.fetch(cache, self.urls[:1])
+        digest = cache.urls[self.urls[0]]['digest']
+        cache.store_derived(digest, 'parsed', {'cells': []})
+        time.sleep(0.01)
+        self.fetch(cache, self.urls[1:])
+        cache.save()
+        self.assertNotIn(digest, cache.objects)
+        self.assertEqual([name for name in os.listdir(os.path.join(self.cache_dir, 'derived'))
+                          if name.startswith(digest)], [])
+
+    def test_shared_bodies_are_kept_while_any_url_refers_to_them(self):
+        self.write('copy.ipynb', '{"cells": [], "name": "a.ipynb"}')
+        copy_url = self.server.url + 'copy.ipynb'
+        cache = NotebookCache(self.cache_dir, max_bytes=70)
+        for urls in (self.urls[:1], self.urls[1:2], [copy_url], self.urls[2:]):
+            self.fetch(cache, urls)
+            time.sleep(0.01)
+        cache.save()
+        self.assertEqual(sorted(cache.urls), sorted([copy_url, self.urls[2]]))
+        self.assertEqual(self.fetch(cache, [copy_url])[copy_url], (200, '{"cells": [], "name": "a.ipynb"}'))
+
+    def test_corrupt_derived_entries_are_misses(self):
+        cache = NotebookCache(self.cache_dir)
+        self.fetch(cache, self.urls[:1])
+        digest = cache.urls[self.urls[0]]['digest']
+        cache.store_derived(digest, 'parsed', {'cells': [1]})
+        self.assertEqual(NotebookCache(self.cache_dir).load_derived(digest, 'parsed'), None)  # not in the index yet
+        cache.save()
+        self.assertEqual(NotebookCache(self.cache_dir).load_derived(digest, 'parsed'), {'cells': [1]})
+
+        path = os.path.join(self.cache_dir, 'derived', '{}.parsed.pickle'.format(digest))
+        with open(path, 'wb') as fid:
+            fid.write('not a pickle')
+        self.assertIsNone(cache.load_derived(digest, 'parsed'))
+        os.remove(path)
+        self.assertIsNone(cache.load_derived(digest, 'parsed'))
+        self.assertIsNone(cache.load_derived(digest, 'other'))
+        cache.store_derived(digest, 'parsed', {'cells': [2]})
+        self.assertEqual(cache.load_derived(digest, 'parsed'), {'cells': [2]})
+
+
+if __name__ == '__main__':
+    unittest.main()
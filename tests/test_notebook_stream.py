@@ -0,0 +1,108 @@
+""" Tests for `notebook_stream`: compacting cells, and writing them back out.
+
+        python -m unittest discover -s tests
+"""
+
+import json
+import os
+import sys
+import unittest
+from collections import OrderedDict
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'scripts'))
+
+from notebook_stream import CompactCell, compact_cell, dump_cell, load_cell
+
+
+def code_cell(source, outputs, members=()):
+    return OrderedDict([(u'cell_type', u'code'), (u'execution_count', 1), (u'metadata', {}),
+                        (u'outputs', outputs), (u'source', source)] + list(members))
+
+
+class CompactCellTest(unittest.TestCase):
+
+    def assertRoundTrips(self, cell):
+        compacted = compact_cell(cell)
+        self.assertEqual(load_cell(compacted), cell)
+        self.assertEqual(json.loads(dump_cell(compacted)), cell)
+
+    def test_escaped_quotes_and_brackets_in_strings(self):
+        self.assertRoundTrips(code_cell([u'print "a \\" ] } [ {"\n', u'x = {"k": [1, 2]}'],
+                                        [{u'name': u'stdout', u'output_type': u'stream',
+                                          u'text': [u'"]}quoted{["\n', u'back\\slash \\"\n']}]))
+
+    def test_text_that_looks_like_json_or_a_merge_conflict(self):
+        self.assertRoundTrips(code_cell(u'<<<<<<< HEAD\n1\n=======\n2\n>>>>>>> theirs\n',
+                                        [{u'output_type': u'execute_result', u'execution_count': 1, u'metadata': {},
+                                          u'data': {u'text/plain': [u'<<<<<<< HEAD', u'{"cells": [']}}]))
+
+    def test_unicode_and_control_characters(self):
+        self.assertRoundTrips(code_cell(u'caf\xe9 = "\u4e2d\U0001f600"\t\r\n', [],
+                                        [(u'metadata', {u'tags': [u'\x00']})]))
+
+    def test_source_as_a_string_or_lines(self):
+        for source in (u'one line', [u'first\n', u'second'], [], u''):
+            self.assertRoundTrips(code_cell(source, []))
+        self.assertRoundTrips(OrderedDict([(u'cell_type', u'markdown'), (u'metadata', {}), (u'source', u'# Q')]))
+
+    def test_dump_keeps_member_order(self):
+        cell = code_cell(u'x', [], [(u'zeta', 1), (u'alpha', 2)])
+        dumped = dump_cell(compact_cell(cell))
+        self.assertEqual(json.loads(dumped, object_pairs_hook=OrderedDict).keys(),
+                         [u'cell_type', u'source', u'execution_count', u'metadata', u'outputs', u'zeta', u'alpha'])
+
+    def test_members_are_read_without_loading_the_cell_type_and_source(self):
+        compacted = compact_cell(code_cell([u'a\n', u'b'], [{u'output_type': u'stream', u'text': u'x'}]))
+        self.assertEqual(compacted[u'cell_type'], u'code')
+        self.assertEqual(compacted[u'source'], (u'a\n', u'b'))
+        self.assertEqual(compacted[u'outputs'], [{u'output_type': u'stream', u'text': u'x'}])
+        self.assertIsNone(compacted.get(u'attachments'))
+        with self.assertRaises(KeyError):
+            compacted[u'attachments']
+
+    def test_interned_lines_and_members_are_shared(self):
+        interned = {}
+        first = compact_cell(code_cell([u'shared\n', u'own 1'], [{u'text': u'big output'}]), interned)
+        second = compact_cell(code_cell([u'shared\n', u'own 2'], [{u'text': u'big output'}]), interned)
+        self.assertIs(first.source[0], second.source[0])
+        self.assertIs(first.rest, second.rest)
+
+    def test_compact_cells_pass_through(self):
+        compacted = compact_cell(code_cell(u'x', []))
+        self.assertIs(compact_cell(compacted), compacted)
+        plain = {u'cell_type': u'markdown', u'source': u'x'}
+        self.assertIs(load_cell(plain), plain)
+        self.assertEqual(json.loads(dump_cell(plain)), plain)
+
+    def test_malformed_cells(self):
+        with self.assertRaises(KeyError):
+            compact_cell({u'source': u'no cell type'})
+        with self.assertRaises(TypeError):
+            compact_cell(code_cell(u'x', [object()]))
+        with self.assertRaises(ValueError):
+            load_cell(CompactCell(u'code', u'x', (u'"outputs": [<<<<<<< HEAD',)))
+
+    def test_replace_members_without_decoding_the_others(self):
+        cell = code_cell(u'x', [{u'output_type': u'stream', u'text': u'x'}], [(u'key ": with" quotes', 1)])
+        compacted = compact_cell(cell)
+        stripped = compacted.replace({u'outputs': [], u'execution_count': None, u'added': True})
+        self.assertEqual(load_cell(stripped), dict(cell, outputs=[], execution_count=None, added=True))
+        self.assertEqual(json.loads(dump_cell(stripped), object_pairs_hook=OrderedDict).keys(),
+                         [u'cell_type', u'source', u'execution_count', u'metadata', u'outputs',
+                          u'key ": with" quotes', u'added'])
+        self.assertIs(stripped.rest[1], compacted.rest[1])
+        self.assertEqual(load_cell(compacted), cell)
+
+    def test_compact_cells_are_interned_again(self):
+        first = compact_cell(code_cell([u'shared\n', u'own 1'], [{u'text': u'big output'}]))
+        second = compact_cell(code_cell([u'shared\n', u'own 2'], [{u'text': u'big output'}]))
+        self.assertIsNot(first.rest, second.rest)
+        interned = {}
+        first, second = compact_cell(first, interned), compact_cell(second, interned)
+        self.assertIs(first.source[0], second.source[0])
+        self.assertIs(first.rest, second.rest)
+        self.assertEqual(load_cell(second), code_cell([u'shared\n', u'own 2'], [{u'text': u'big output'}]))
+
+
+if __name__ == '__main__':
+    unittest.main()